@@ -0,0 +1,102 @@
+"""Declarative age class rules
+
+Each rule set lists the age classes as (max_age, name) pairs in ascending
+order, the last class having max_age None.  In names, '{g}' is replaced by
+the gender letter.  The rule sets are compiled into lookup arrays indexed by
+gender and age on import, so classifying a runner is a list access.  The
+same arrays are handed to the browser by runner/_age_class_js.html.
+"""
+
+from __future__ import division, print_function
+
+import json
+
+
+# Largest age in the lookup arrays, older runners are classified as this age
+MAX_AGE = 120
+
+# Letters used for the genders in the class names
+GENDER_LETTERS = (('male', 'M'), ('female', 'W'))
+
+# Name of the rule set used by default
+DEFAULT_RULES = 'dlv'
+
+# Available rule sets by name
+RULES = {
+    'dlv': {
+        'title': 'DLV (Schueler, Jugend, 5-Jahres-Klassen)',
+        'classes': [
+            (9, '{g}S D'),
+            (11, '{g}S C'),
+            (13, '{g}S B'),
+            (15, '{g}S A'),
+            (17, '{g}JG B'),
+            (19, '{g}JG A'),
+            (29, 'L{g}20'),
+            (34, 'L{g}30'),
+            (39, 'L{g}35'),
+            (44, 'L{g}40'),
+            (49, 'L{g}45'),
+            (54, 'L{g}50'),
+            (59, 'L{g}55'),
+            (64, 'L{g}60'),
+            (69, 'L{g}65'),
+            (None, 'L{g}70'),
+        ],
+    },
+    'decades': {
+        'title': '10-Jahres-Klassen',
+        'classes': [
+            (19, '{g}U20'),
+            (29, '{g}20'),
+            (39, '{g}30'),
+            (49, '{g}40'),
+            (59, '{g}50'),
+            (69, '{g}60'),
+            (None, '{g}70'),
+        ],
+    },
+}
+
+
+class AgeClassTable(object):
+    """Age class rule set compiled into lookup arrays"""
+
+    def __init__(self, name, title, classes):
+        self.name = name
+        self.title = title
+        self.lookup = {}
+        for gender, letter in GENDER_LETTERS:
+            self.lookup[gender] = self._compile(classes, letter)
+
+    @staticmethod
+    def _compile(classes, letter):
+        result = []
+        for max_age, name in classes:
+            if max_age is None:
+                max_age = MAX_AGE
+            name = name.format(g=letter)
+            while len(result) <= max_age:
+                result.append(name)
+        return result
+
+    def classify(self, year, gender, birth_year):
+        """Return age class in the event year, None if not possible"""
+        if not birth_year or gender not in self.lookup:
+            return None
+        age = min(max(year - birth_year, 0), MAX_AGE)
+        return self.lookup[gender][age]
+
+    def to_json(self):
+        """Return lookup arrays as JSON for classification in the browser"""
+        return json.dumps(self.lookup, sort_keys=True)
+
+
+# Compiled rule sets by name
+TABLES = dict((name, AgeClassTable(name, rules['title'], rules['classes']))
+              for name, rules in RULES.items())
+
+
+def get_table(name):
+    """Return AgeClassTable by name, falling back to the default rules"""
+    return TABLES.get(name) or TABLES[DEFAULT_RULES]
@@ -0,0 +1,41 @@
+"""Benchmark of rendering certificates
+
+Usage: python benchmarks/certificates.py [num_certificates ...]
+
+Renders 300 and 3,000 certificates (or the given numbers) in one document
+and in chunks of certificates.CHUNK_SIZE that are merged afterwards.
+"""
+
+from __future__ import division, print_function
+
+import sys
+
+import common
+
+
+def make_certificates(num):
+    import certificates
+    return [certificates.Certificate(i + 1, u'Runner {}'.format(i + 1),
+                                     '{}:{:02}'.format(20 + i % 70, i % 60),
+                                     i + 1, 'M30', i % 100 + 1)
+            for i in range(num)]
+
+
+def main(argv):
+    sizes = [int(x) for x in argv[1:]] or [300, 3000]
+    common.setup_path()
+    import certificates
+    for size in sizes:
+        certs = make_certificates(size)
+        with common.timed('render {} certificates'.format(size), size):
+            certificates.render(certs, 'Benchmark')
+        with common.timed('render {} certificates in chunks'.format(size),
+                          size):
+            chunks = [certs[i:i + certificates.CHUNK_SIZE]
+                      for i in range(0, size, certificates.CHUNK_SIZE)]
+            certificates.merge([certificates.render(chunk, 'Benchmark')
+                                for chunk in chunks])
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,52 @@
+"""Helpers shared by the benchmark scripts
+
+The benchmarks run against the service stubs of the App Engine SDK, which
+must be importable, e.g. by putting the SDK directory on the PYTHONPATH.
+"""
+
+from __future__ import division, print_function
+
+import contextlib
+import os.path
+import sys
+import time
+
+
+# Root directory of the application
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_path():
+    """Make the application, its libraries and the SDK importable"""
+    sys.path[0:0] = [ROOT, os.path.join(ROOT, 'lib')]
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+
+
+def setup_testbed():
+    """Activate and return testbed with the stubs used by the application"""
+    from google.appengine.ext import ndb
+    from google.appengine.ext import testbed
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_app_identity_stub()
+    tb.init_blobstore_stub()
+    tb.init_datastore_v3_stub()
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=ROOT)
+    tb.init_urlfetch_stub()
+    tb.init_user_stub()
+    ndb.get_context().clear_cache()
+    return tb
+
+
+@contextlib.contextmanager
+def timed(label, count=None):
+    """Print the wall time of the block, and count per second if given"""
+    start = time.time()
+    yield
+    elapsed = time.time() - start
+    line = '{:<40} {:8.3f} s'.format(label, elapsed)
+    if count:
+        line += '  {:10.1f} /s'.format(count / elapsed)
+    print(line)
@@ -0,0 +1,62 @@
+"""Benchmark of filling the forms with the formfill extension
+
+Usage: python benchmarks/formfill.py [num_renderings]
+
+Renders the finish time form and the runner form 2,000 times (or the given
+number) with the form skeletons cached by the extension and with the
+form tokenized by formencode.htmlfill on every rendering.
+"""
+
+from __future__ import division, print_function
+
+import os.path
+import sys
+
+import common
+
+
+FORMS = {
+    'event/_finished_form.html': u'{% include "event/_finished_form.html" %}',
+    'runner/_form.html': (u'{% formfill runner with errors %}'
+                          u'{% include "runner/_form.html" %}'
+                          u'{% endformfill %}'),
+}
+
+
+class Key(object):
+    """Stand-in for the ndb.Key of an event"""
+
+    def urlsafe(self):
+        return 'ahBkZXZ-c2YtbG90dGUtcnVu'
+
+
+class Event(object):
+    key = Key()
+
+
+def main(argv):
+    num = int(argv[1]) if len(argv) > 1 else 2000
+    sys.path[0:0] = [common.ROOT, os.path.join(common.ROOT, 'lib')]
+    import jinja2
+    from formencode_jinja2.skeleton import SkeletonCache
+    env = jinja2.Environment(loader=jinja2.FileSystemLoader(common.ROOT),
+                             extensions=['jinja2.ext.autoescape',
+                                         'formencode_jinja2.formfill'],
+                             autoescape=True)
+    values = {'event': Event(),
+              'vals': {'start_no': '17', 'time': '20:33'},
+              'runner': {'start_no': '17', 'name': u'Max Mustermann',
+                         'gender': 'male', 'race': '6km'},
+              'errors': {'time': u'Bitte eine Zeit angeben'}}
+    for name, source in sorted(FORMS.items()):
+        template = env.from_string(source)
+        for label, skeletons in (('skeleton', SkeletonCache()),
+                                 ('htmlfill', None)):
+            env.formfill_skeletons = skeletons
+            with common.timed('{} {}'.format(label, name), num):
+                for _ in xrange(num):
+                    template.render(values)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,51 @@
+"""Micro-benchmark of formencode.htmlfill on bulk edit forms
+
+Usage: python benchmarks/htmlfill.py [num_rows ...]
+
+Fills forms with 100, 1,000 and 5,000 runner rows (or the given numbers)
+of a text input, a select and a checkbox each.  Every tenth row has an
+error without <form:error> tag, which htmlfill inserts before the field.
+"""
+
+from __future__ import division, print_function
+
+import os.path
+import sys
+
+import common
+
+
+ROW = (u'<tr><td><input type="text" name="name-{0}" /></td>'
+       u'<td><select name="race-{0}"><option value="6km">6 km</option>'
+       u'<option value="12km">12 km</option></select></td>'
+       u'<td><input type="checkbox" name="paid-{0}" value="yes" /></td>'
+       u'</tr>\n')
+
+
+def make_form(num_rows):
+    rows = u''.join(ROW.format(i) for i in xrange(num_rows))
+    return u'<form method="post"><table>\n{}</table></form>'.format(rows)
+
+
+def main(argv):
+    sizes = [int(x) for x in argv[1:]] or [100, 1000, 5000]
+    sys.path[0:0] = [os.path.join(common.ROOT, 'lib')]
+    from formencode import htmlfill
+    for size in sizes:
+        form = make_form(size)
+        defaults = {}
+        errors = {}
+        for i in xrange(size):
+            defaults['name-{}'.format(i)] = u'Runner {}'.format(i)
+            defaults['race-{}'.format(i)] = '12km' if i % 2 else '6km'
+            defaults['paid-{}'.format(i)] = 'yes' if i % 3 else ''
+            if i % 10 == 0:
+                errors['name-{}'.format(i)] = u'Bitte einen Namen angeben'
+        with common.timed('tokenize {} rows'.format(size), size):
+            htmlfill.tokenize(form)
+        with common.timed('render {} rows'.format(size), size):
+            htmlfill.render(form, defaults, errors)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,59 @@
+"""Benchmark of the import time of the application on a new instance
+
+Usage: python benchmarks/import_profile.py [num_modules]
+
+Imports main in a fresh interpreter with __import__ wrapped, and prints the
+total import time and the modules with the largest import times (20 or the
+given number), including the time of the modules they import.
+"""
+
+from __future__ import division, print_function
+
+import json
+import subprocess
+import sys
+import time
+
+import common
+
+
+def profile_imports(name):
+    """Import module name, return dict with import time by module"""
+    import __builtin__
+    timings = {}
+    original_import = __builtin__.__import__
+
+    def timed_import(name, *args, **kwargs):
+        num_modules = len(sys.modules)
+        start = time.time()
+        try:
+            return original_import(name, *args, **kwargs)
+        finally:
+            if len(sys.modules) > num_modules and name not in timings:
+                timings[name] = time.time() - start
+
+    __builtin__.__import__ = timed_import
+    try:
+        __import__(name)
+    finally:
+        __builtin__.__import__ = original_import
+    return timings
+
+
+def main(argv):
+    if argv[1:] == ['--child']:
+        common.setup_path()
+        json.dump(profile_imports('main'), sys.stdout)
+        return
+    num_modules = int(argv[1]) if len(argv) > 1 else 20
+    timings = json.loads(subprocess.check_output(
+            [sys.executable, __file__, '--child']))
+    print('{:<40} {:8.3f} s'.format('import main', timings['main']))
+    del timings['main']
+    for name, elapsed in sorted(timings.items(), key=lambda x: -x[1])[
+            :num_modules]:
+        print('  {:<38} {:8.3f} s'.format(name, elapsed))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,50 @@
+"""Benchmark of the TSV import for events of different sizes
+
+Usage: python benchmarks/import_tsv.py [num_rows ...]
+
+Imports generated events with 500, 5,000 and 20,000 runners (or the given
+numbers) into the datastore stub and prints the import throughput.
+"""
+
+from __future__ import division, print_function
+
+import random
+import sys
+
+import common
+
+
+HEADER = ['#start_no', 'name', 'team', 'birth_year', 'gender', 'age_class',
+          'race', 'time']
+
+
+def make_tsv(num_rows, seed=42):
+    """Return TSV text of an event with num_rows runners"""
+    rnd = random.Random(seed)
+    lines = ['#title:\tBenchmark', '#year:\t2016',
+             '#next_start_no:\t{}'.format(num_rows + 1), '\t'.join(HEADER)]
+    for i in range(num_rows):
+        time = ''
+        if rnd.random() < 0.8:
+            time = '{}:{:02}'.format(rnd.randint(20, 90), rnd.randint(0, 59))
+        row = [i + 1, 'Runner {}'.format(i + 1), 'Team {}'.format(i % 50),
+               rnd.randint(1940, 2010), rnd.choice(['male', 'female']), '',
+               rnd.choice(['6km', '12km']), time]
+        lines.append('\t'.join(map(str, row)))
+    return '\n'.join(lines) + '\n'
+
+
+def main(argv):
+    sizes = [int(x) for x in argv[1:]] or [500, 5000, 20000]
+    common.setup_path()
+    for size in sizes:
+        tb = common.setup_testbed()
+        import main as app
+        tsv = make_tsv(size)
+        with common.timed('import {} rows'.format(size), size):
+            app.TsvImporter().run(tsv)
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,78 @@
+"""Benchmark of rendering finished lists with ReportLab and xhtml2pdf
+
+Usage: python benchmarks/report_lists.py [num_rows ...]
+
+Renders finished lists by gender with 500, 3,000 and 10,000 runners (or
+the given numbers) with pdflists and from the HTML template, the latter
+with the reused htmlreports.ReportRenderer and with a new xhtml2pdf setup
+per document.
+"""
+
+from __future__ import division, print_function
+
+import random
+import sys
+
+import common
+
+
+def make_rows(num_rows, seed=42):
+    """Return snapshot.Rows of num_rows finished runners ordered by time"""
+    import snapshot
+    rnd = random.Random(seed)
+    rows = [snapshot.Row(i + 1, u'Runner {}'.format(i + 1),
+                         u'Team {}'.format(i % 50),
+                         rnd.choice(['male', 'female']), 1980, u'M30',
+                         rnd.choice(['6km', '12km']),
+                         rnd.randint(20 * 60000, 90 * 60000))
+            for i in range(num_rows)]
+    return sorted(rows, key=lambda r: r.time)
+
+
+class Results(object):
+    """Stand-in for main.Results with the places of rows"""
+
+    def __init__(self, rows):
+        self.places = dict((r.start_no, (i + 1, i + 1, i + 1))
+                           for i, r in enumerate(rows))
+
+    def get_places(self):
+        return self.places
+
+
+class CreatePDFRenderer(object):
+    """Stand-in for htmlreports.ReportRenderer using pisa.CreatePDF()"""
+
+    def render(self, html):
+        import StringIO
+        from xhtml2pdf import pisa
+        out = StringIO.StringIO()
+        pisa.CreatePDF(html, out, encoding='utf-8')
+        return out.getvalue()
+
+
+def main(argv):
+    sizes = [int(x) for x in argv[1:]] or [500, 3000, 10000]
+    common.setup_path()
+    import main as app
+    event = app.Event(title=u'Benchmark', year=2016)
+    for size in sizes:
+        rows = make_rows(size)
+        for renderer in ('pdflists', 'html'):
+            generator = app.ReportGenerator(event, {'renderer': renderer},
+                                            Results(rows))
+            with common.timed('{} {} rows'.format(renderer, size), size):
+                generator._get_finished_list_gender(None, rows)
+        renderer = app.get_report_renderer
+        app.get_report_renderer = CreatePDFRenderer
+        try:
+            generator = app.ReportGenerator(event, {'renderer': 'html'},
+                                            Results(rows))
+            with common.timed('CreatePDF {} rows'.format(size), size):
+                generator._get_finished_list_gender(None, rows)
+        finally:
+            app.get_report_renderer = renderer
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
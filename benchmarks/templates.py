@@ -0,0 +1,42 @@
+"""Benchmark of loading the templates on a new instance
+
+Usage: python benchmarks/templates.py
+
+Loads all templates into a fresh Jinja2 Environment compiling from source
+and from the modules written by compile_templates.py, which must have
+been run before.
+"""
+
+from __future__ import division, print_function
+
+import sys
+
+import common
+
+
+def load_all(env, names):
+    for name in names:
+        env.get_template(name)
+
+
+def main(argv):
+    common.setup_path()
+    import jinja2
+    import compile_templates
+    import main as app
+
+    source_loader = jinja2.FileSystemLoader(app.TEMPLATE_DIR)
+    names = source_loader.list_templates()
+    names = [name for name in names if compile_templates.is_template(name)]
+    env = app.create_jinja_environment(source_loader)
+    with common.timed('compile {} templates'.format(len(names)), len(names)):
+        load_all(env, names)
+    env = app.create_jinja_environment(
+            jinja2.ModuleLoader(app.COMPILED_TEMPLATE_DIR))
+    with common.timed('load {} compiled templates'.format(len(names)),
+                      len(names)):
+        load_all(env, names)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
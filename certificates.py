@@ -0,0 +1,97 @@
+"""Certificate PDFs of the finished runners
+
+The static part of the certificate page is drawn once per document as a
+form XObject, each page only places the form and draws the runner's
+texts.  The fonts are registered once per process.  Large runs are
+rendered in chunks by separate tasks and merged with merge().
+"""
+
+from __future__ import division, print_function
+
+import StringIO
+import collections
+import threading
+
+from reportlab.lib import pagesizes
+from reportlab.lib import units
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+
+# Font of the certificate texts
+FONT = 'Vera'
+
+# Name of the form XObject with the static part of the page
+BACKGROUND = 'background'
+
+# Number of certificates rendered by one task
+CHUNK_SIZE = 500
+
+# Texts of the certificate of one runner
+Certificate = collections.namedtuple(
+        'Certificate', ['start_no', 'name', 'time', 'place', 'age_class',
+                        'age_class_place'])
+
+_fonts_lock = threading.Lock()
+_fonts_registered = []
+
+
+def register_fonts():
+    """Register the fonts with ReportLab unless done before"""
+    with _fonts_lock:
+        if not _fonts_registered:
+            pdfmetrics.registerFont(TTFont(FONT, 'Vera.ttf'))
+            _fonts_registered.append(FONT)
+
+
+def _draw_background(c, title):
+    cm = units.cm
+    c.beginForm(BACKGROUND)
+    c.setFont(FONT, 36)
+    c.drawCentredString(10.5 * cm, 25 * cm, 'Urkunde')
+    c.setFont(FONT, 18)
+    c.drawCentredString(10.5 * cm, 23.5 * cm, title or '')
+    c.rect(1.5 * cm, 1.5 * cm, 18 * cm, 26.7 * cm)
+    c.endForm()
+
+
+def render(certificates, title):
+    """Return PDF with one page for each Certificate"""
+    register_fonts()
+    cm = units.cm
+    buf = StringIO.StringIO()
+    c = canvas.Canvas(buf, pagesize=pagesizes.A4)
+    _draw_background(c, title)
+    for cert in certificates:
+        c.doForm(BACKGROUND)
+        c.setFont(FONT, 24)
+        c.drawCentredString(10.5 * cm, 17 * cm, cert.name or '')
+        c.setFont(FONT, 14)
+        c.drawCentredString(10.5 * cm, 15 * cm, cert.time)
+        if cert.place:
+            c.drawCentredString(10.5 * cm, 13.5 * cm,
+                                '{}. Platz gesamt'.format(cert.place))
+        if cert.age_class_place and cert.age_class:
+            c.drawCentredString(10.5 * cm, 12.5 * cm, '{}. Platz {}'.format(
+                cert.age_class_place, cert.age_class))
+        c.showPage()
+    c.save()
+    return buf.getvalue()
+
+
+def chunk_ranges(start_nos, size=CHUNK_SIZE):
+    """Return (first, last) start numbers of chunks of sorted start_nos"""
+    return [(start_nos[i], start_nos[min(i + size, len(start_nos)) - 1])
+            for i in xrange(0, len(start_nos), size)]
+
+
+def merge(pdfs):
+    """Return PDF with the pages of all pdfs"""
+    import PyPDF2
+    merger = PyPDF2.PdfFileMerger()
+    for pdf in pdfs:
+        merger.append(StringIO.StringIO(pdf))
+    out = StringIO.StringIO()
+    merger.write(out)
+    return out.getvalue()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""Precompile the Jinja2 templates to Python modules
+
+Usage: python compile_templates.py
+
+Run before each deployment.  The application loads the templates from
+compiled_templates/ with jinja2.ModuleLoader, so new instances do not have
+to compile them.  The App Engine SDK must be importable, e.g. by putting
+the SDK directory on the PYTHONPATH.
+"""
+
+from __future__ import division, print_function
+
+import os.path
+import shutil
+import sys
+
+
+# Root directory of the application
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Directories with templates below ROOT, besides ROOT itself
+TEMPLATE_SUBDIRS = ('event', 'runner')
+
+
+def is_template(name):
+    """Return whether name is one of the application's templates"""
+    dirname, _, basename = name.rpartition('/')
+    return (basename.endswith('.html') and
+            (not dirname or dirname in TEMPLATE_SUBDIRS))
+
+
+def main(argv):
+    sys.path[0:0] = [ROOT, os.path.join(ROOT, 'lib')]
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    import jinja2
+    import main as app
+
+    env = app.create_jinja_environment(
+            jinja2.FileSystemLoader(app.TEMPLATE_DIR))
+    if os.path.isdir(app.COMPILED_TEMPLATE_DIR):
+        shutil.rmtree(app.COMPILED_TEMPLATE_DIR)
+    env.compile_templates(app.COMPILED_TEMPLATE_DIR, zip=None,
+                          filter_func=is_template, log_function=print,
+                          ignore_errors=False)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
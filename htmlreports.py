@@ -0,0 +1,126 @@
+"""Rendering of the HTML reports with a reused xhtml2pdf setup
+
+xhtml2pdf parses its default stylesheet and the report's own stylesheet
+for every document.  The ReportRenderer is created once per instance and
+parses each stylesheet only once, the documents it renders share the
+parsed rules.  The @page and @frame rules of the report's stylesheet set
+up the page size, page templates and static frames of the document; the
+renderer keeps them per stylesheet and gives every document its own
+copies, which it fills.  Only the body is parsed per report.  The
+document is built like xhtml2pdf.document.pisaDocument() does, without
+its support for background PDFs, which the reports do not use.
+"""
+
+from __future__ import division, print_function
+
+import copy
+import StringIO
+import threading
+
+from reportlab.platypus.frames import Frame
+from xhtml2pdf import context as pisa_context
+from xhtml2pdf.default import DEFAULT_CSS
+from xhtml2pdf.document import pisaStory
+from xhtml2pdf.util import getBox
+from xhtml2pdf.w3c import css
+from xhtml2pdf.xhtml2pdf_reportlab import PmlBaseDoc
+from xhtml2pdf.xhtml2pdf_reportlab import PmlPageTemplate
+
+
+class _Context(pisa_context.pisaContext):
+    """pisaContext taking the parsed stylesheets from its renderer"""
+
+    def __init__(self, renderer, path=None):
+        pisa_context.pisaContext.__init__(self, path)
+        self.renderer = renderer
+
+    def parseCSS(self):
+        default_text, self.cssDefaultText = self.cssDefaultText, ''
+        text, self.cssText = self.cssText, ''
+        pisa_context.pisaContext.parseCSS(self)
+        self.cssDefault = self.renderer.parse_css(default_text,
+                                                  self.cssParser)
+        self.renderer.parse_page_css(text, self)
+        self.cssCascade = css.CSSCascadeStrategy(userAgent=self.cssDefault,
+                                                 user=self.css)
+        self.cssCascade.parser = self.cssParser
+
+
+class _PageSetup(object):
+    """Parsed stylesheet with the page setup its @page rules made"""
+
+    def __init__(self, css, context):
+        self.css = css
+        self.page_size = context.pageSize
+        # Copied before the document fills the static frames
+        self.templates, self.frames = copy.deepcopy(
+                (context.templateList, context.frameStatic))
+
+    def apply(self, context):
+        """Set the stylesheet and copies of the page setup on context"""
+        context.css = self.css
+        context.pageSize = self.page_size
+        context.templateList, context.frameStatic = copy.deepcopy(
+                (self.templates, self.frames))
+
+
+class ReportRenderer(object):
+    """Renders HTML to PDF, sharing the parsed stylesheets"""
+
+    def __init__(self, default_css=DEFAULT_CSS):
+        self.default_css = default_css
+        self._parsed = {}
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def parse_css(self, text, parser):
+        """Return text parsed by parser, parsing each text only once
+
+        Only for stylesheets without @page and @font-face rules, which
+        change the context of the parser.
+        """
+        with self._lock:
+            result = self._parsed.get(text)
+            if result is None:
+                result = self._parsed[text] = parser.parse(text)
+        return result
+
+    def parse_page_css(self, text, context):
+        """Parse the report stylesheet text for context
+
+        The page size, page templates and static frames, which the @page
+        and @frame rules set up on the context, are kept with the parsed
+        rules.  Each text is parsed only once, every context gets its own
+        copies of the templates and frames.  Stylesheets with @font-face
+        or @import rules are not supported.
+        """
+        with self._lock:
+            setup = self._pages.get(text)
+            if setup is None:
+                css = context.cssParser.parse(text)
+                setup = self._pages[text] = _PageSetup(css, context)
+        setup.apply(context)
+
+    def render(self, html):
+        """Return PDF rendered from html"""
+        context = pisaStory(html, default_css=self.default_css,
+                            encoding='utf-8', context=_Context(self))
+        out = StringIO.StringIO()
+        doc = PmlBaseDoc(out, pagesize=context.pageSize,
+                         title=context.meta['title'].strip(),
+                         showBoundary=0, allowSplitting=1)
+        templates = dict(context.templateList)
+        body = templates.pop('body', None)
+        if body is None:
+            x, y, w, h = getBox('1cm 1cm -1cm -1cm', context.pageSize)
+            body = PmlPageTemplate(
+                    id='body', pagesize=context.pageSize,
+                    frames=[Frame(x, y, w, h, id='body', leftPadding=0,
+                                  rightPadding=0, bottomPadding=0,
+                                  topPadding=0)])
+        doc.addPageTemplates([body] + templates.values())
+        if context.multiBuild:
+            doc.multiBuild(context.story)
+        else:
+            doc.build(context.story)
+        return out.getvalue()
@@ -2,13 +2,15 @@
 Parser for HTML forms, that fills in defaults and errors.  See ``render``.
 """
 
+import HTMLParser
+import collections
 import re
 
-from formencode.rewritingparser import RewritingParser, html_quote
+from formencode.rewritingparser import RewritingParser, html_quote, unescape
 
 __all__ = ['render', 'htmlliteral', 'default_formatter',
            'none_formatter', 'escape_formatter',
-           'FillingParser']
+           'FillingParser', 'FillTag', 'tokenize']
 
 
 def render(form, defaults=None, errors=None, use_all_keys=False,
@@ -168,6 +170,91 @@ def ignore_formatter(error):
     return ''
 
 
+# Tags rewritten by the FillingParser, everything else is copied as is
+FILL_TAGS = frozenset(['input', 'select', 'option', 'textarea',
+                       'form:error', 'form:iferror'])
+
+# A comment, a CDATA section, a script or style element with its content,
+# or a tag.  Quoted attribute values may contain '>'.
+_token_re = re.compile(r'''
+    <!--.*?-->
+  | <!\[CDATA\[.*?\]\]>
+  | <(script|style)\b(?:[^>"']|"[^"]*"|'[^']*')*>.*?</\1\s*>
+  | <(/?)[a-zA-Z][^\s/>\x00]*(?:[^>"']|"[^"]*"|'[^']*')*>
+''', re.I | re.S | re.X)
+
+
+class FillTag(collections.namedtuple(
+        'FillTag', ['tag', 'attrs', 'startend', 'end', 'text', 'pos'])):
+    """
+    A tag of ``FILL_TAGS`` found by ``tokenize``, with its source
+    ``text`` and its offset ``pos`` in the form.  ``attrs`` are parsed
+    like ``HTMLParser`` does, ``end`` is true for end tags.
+    """
+    __slots__ = ()
+
+
+def tokenize(form):
+    """
+    Split the ``form`` into the tags rewritten by the ``FillingParser``
+    in a single pass.  Returns a list of ``FillTag`` tuples and of the
+    source text between them, which is copied as is.
+    """
+    tokens = []
+    last = 0
+    for match in _token_re.finditer(form):
+        end = match.group(2)
+        if end is None:
+            continue
+        start = match.start()
+        name_match = HTMLParser.tagfind.match(form, start + len(end) + 1)
+        tag = name_match.group(1).lower()
+        if tag not in FILL_TAGS:
+            continue
+        if end:
+            token = FillTag(tag, (), False, True, match.group(0), start)
+        else:
+            attrs, startend = _parse_attrs(form, name_match.end(),
+                                           match.end())
+            if attrs is None:
+                continue
+            token = FillTag(tag, tuple(attrs), startend, False,
+                            match.group(0), start)
+        if start > last:
+            tokens.append(form[last:start])
+        tokens.append(token)
+        last = match.end()
+    if last < len(form):
+        tokens.append(form[last:])
+    return tokens
+
+
+def _parse_attrs(form, pos, endpos):
+    """
+    Return the attributes of the start tag ending at ``endpos`` and
+    whether it is an empty tag, or ``None`` if it is malformed.
+    """
+    attrs = []
+    while pos < endpos:
+        match = HTMLParser.attrfind.match(form, pos)
+        if not match:
+            break
+        name, rest, value = match.group(1, 2, 3)
+        if not rest:
+            value = None
+        elif (value[:1] == '\'' == value[-1:]
+              or value[:1] == '"' == value[-1:]):
+            value = value[1:-1]
+        if value:
+            value = unescape(value)
+        attrs.append((name.lower(), value))
+        pos = match.end()
+    end = form[pos:endpos].strip()
+    if end not in ('>', '/>'):
+        return None, False
+    return attrs, end == '/>'
+
+
 class FillingParser(RewritingParser):
     r"""
     Fills HTML with default values, as in a form.
@@ -217,8 +304,6 @@ class FillingParser(RewritingParser):
                  force_defaults=True, skip_passwords=False):
         RewritingParser.__init__(self)
         self.source = None
-        self.lines = None
-        self.source_pos = None
         self.defaults = defaults
         self.in_textarea = None
         self.skip_textarea = False
@@ -247,6 +332,68 @@ class FillingParser(RewritingParser):
         self.prefix_error = prefix_error
         self.force_defaults = force_defaults
         self.skip_passwords = skip_passwords
+        # Source text of the last token, not yet written
+        self._pending_text = ''
+        self._pos = 0
+        # Index in _content of the first marker by name, and the texts
+        # inserted before these indexes or before all content
+        self._markers = {}
+        self._inserts = {}
+        self._inserts_first = []
+
+    def feed(self, data):
+        """
+        Add ``data`` to the form.  The form is tokenized and filled
+        when the parser is closed.
+        """
+        self.data_is_str = isinstance(data, str)
+        if self.source is None:
+            self.source = data
+        else:
+            self.source += data
+        if self.listener:
+            self.listener.reset()
+
+    def get_tokens(self):
+        """
+        Return the tokens of the form as returned by ``tokenize``
+        """
+        return tokenize(self.source or '')
+
+    def getpos(self):
+        """
+        Return line number and offset of the current tag
+        """
+        source = self.source or ''
+        line_start = source.rfind('\n', 0, self._pos) + 1
+        return source.count('\n', 0, self._pos) + 1, self._pos - line_start
+
+    def write_pos(self):
+        text, self._pending_text = self._pending_text, ''
+        if self.skip_output():
+            return
+        if self.skip_next:
+            self.skip_next = False
+            return
+        self.write_text(text)
+
+    def handle_tokens(self, tokens):
+        """
+        Write the text tokens and handle the ``FillTag`` tokens
+        """
+        for token in tokens:
+            if isinstance(token, FillTag):
+                self._pos = token.pos
+                if token.end:
+                    self.handle_endtag(token.tag)
+                elif token.startend:
+                    self.handle_startendtag(token.tag, list(token.attrs))
+                else:
+                    self.handle_starttag(token.tag, list(token.attrs))
+                self._pending_text = token.text
+            else:
+                self.handle_misc(None)
+                self._pending_text = token
 
     def str_compare(self, str1, str2):
         """
@@ -267,8 +414,8 @@ class FillingParser(RewritingParser):
         return str1 == str2
 
     def close(self):
+        self.handle_tokens(self.get_tokens())
         self.handle_misc(None)
-        RewritingParser.close(self)
         unused_errors = self.errors.copy()
         for key in self.used_errors:
             if key in unused_errors:
@@ -280,6 +427,7 @@ class FillingParser(RewritingParser):
                 self.insert_at_marker(
                     key, error_message)
             unused_errors = {}
+        self._apply_inserts()
         if self.use_all_keys:
             unused = self.defaults.copy()
             for key in self.used_keys:
@@ -552,15 +700,35 @@ class FillingParser(RewritingParser):
         return self.str_compare(obj, value)
 
     def write_marker(self, marker):
+        self._markers.setdefault(marker, len(self._content))
         self._content.append((marker,))
 
     def insert_at_marker(self, marker, text):
-        for i, item in enumerate(self._content):
-            if item == (marker,):
-                self._content.insert(i, text)
-                break
+        """
+        Insert ``text`` before the first ``marker``, or before all
+        content if there is no such marker.  The texts are added to
+        the content by ``_apply_inserts``.
+        """
+        i = self._markers.get(marker)
+        if i is None:
+            self._inserts_first.append(text)
         else:
-            self._content.insert(0, text)
+            self._inserts.setdefault(i, []).append(text)
+
+    def _apply_inserts(self):
+        if not (self._inserts or self._inserts_first):
+            return
+        # Each text without marker is inserted before the previous ones
+        content = self._inserts_first[::-1]
+        last = 0
+        for i in sorted(self._inserts):
+            content.extend(self._content[last:i])
+            content.extend(self._inserts[i])
+            last = i
+        content.extend(self._content[last:])
+        self._content = content
+        self._inserts = {}
+        self._inserts_first = []
 
 
 # This can potentially be extended globally
@@ -24,6 +24,35 @@ def html_quote(v):
     return escape(v, True)
 
 
+_entityref_re = re.compile('&([a-zA-Z][-.a-zA-Z\d]*);')
+_charref_re = re.compile('&#(\d+|[xX][a-fA-F\d]+);')
+
+
+def unescape(s):
+    """Replace the entity and character references in ``s``"""
+    s = _entityref_re.sub(_sub_entityref, s)
+    s = _charref_re.sub(_sub_charref, s)
+    return s
+
+
+def _sub_entityref(match):
+    name = match.group(1)
+    if name not in name2codepoint:
+        # If we don't recognize it, pass it through as though it
+        # wasn't an entity ref at all
+        return match.group(0)
+    return unichr(name2codepoint[name])
+
+
+def _sub_charref(match):
+    num = match.group(1)
+    if num.lower().startswith('x'):
+        num = int(num[1:], 16)
+    else:
+        num = int(num)
+    return unichr(num)
+
+
 class RewritingParser(HTMLParser.HTMLParser):
 
     listener = None
@@ -42,29 +71,8 @@ class RewritingParser(HTMLParser.HTMLParser):
             self.listener.reset()
         HTMLParser.HTMLParser.feed(self, data)
 
-    _entityref_re = re.compile('&([a-zA-Z][-.a-zA-Z\d]*);')
-    _charref_re = re.compile('&#(\d+|[xX][a-fA-F\d]+);')
-
     def unescape(self, s):
-        s = self._entityref_re.sub(self._sub_entityref, s)
-        s = self._charref_re.sub(self._sub_charref, s)
-        return s
-
-    def _sub_entityref(self, match):
-        name = match.group(1)
-        if name not in name2codepoint:
-            # If we don't recognize it, pass it through as though it
-            # wasn't an entity ref at all
-            return match.group(0)
-        return unichr(name2codepoint[name])
-
-    def _sub_charref(self, match):
-        num = match.group(1)
-        if num.lower().startswith('x'):
-            num = int(num[1:], 16)
-        else:
-            num = int(num)
-        return unichr(num)
+        return unescape(s)
 
     def handle_misc(self, whatever):
         self.write_pos()
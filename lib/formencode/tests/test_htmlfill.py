@@ -467,3 +467,38 @@ def test_mix_str_and_unicode():
     assert expected == rendered
     rendered = htmlfill.render(uhtml, defaults=ucheese, encoding='utf-8')
     assert expected == rendered
+
+
+def test_auto_insert_errors_order():
+    html = ('<input type="text" name="a"><input type="text" name="b">'
+            '<input type="text" name="a">')
+    result = htmlfill.render(html, errors={'a': 'A', 'b': 'B', 'c': 'C'},
+                             auto_error_formatter=lambda error: error,
+                             error_class=None)
+    assert result == ('<!-- for: c -->\nC'
+                      '<!-- for: a -->\nA<input type="text" name="a" value="">'
+                      '<!-- for: b -->\nB<input type="text" name="b" value="">'
+                      '<input type="text" name="a" value="">')
+
+
+def test_tokenize_skips_comments_and_scripts():
+    html = ('<!-- <input name="a"> --><script>"<input name=\'a\'>"</script>'
+            '<div title="<input name=a>">x</div><input name="a" />')
+    tokens = htmlfill.tokenize(html)
+    assert len(tokens) == 2
+    assert tokens[0] == html[:tokens[1].pos]
+    assert tokens[1].tag == 'input'
+    assert tokens[1].attrs == (('name', 'a'),)
+    assert tokens[1].startend
+    assert (htmlfill.render(html, {'a': '1'})
+            == html[:tokens[1].pos] + '<input name="a" value="1" />')
+
+
+def test_tokenize_skips_cdata_sections():
+    html = '<![CDATA[ <input name="a"> ]]><input name="a" />'
+    tokens = htmlfill.tokenize(html)
+    assert len(tokens) == 2
+    assert tokens[0] == html[:tokens[1].pos]
+    assert tokens[1].tag == 'input'
+    assert (htmlfill.render(html, {'a': '1'})
+            == html[:tokens[1].pos] + '<input name="a" value="1" />')
@@ -4,6 +4,8 @@ import jinja2
 import jinja2.ext
 from jinja2 import nodes
 
+from .skeleton import SkeletonCache
+
 
 __all__ = ['FormFillExtension']
 
@@ -71,6 +73,15 @@ class FormFillExtension(jinja2.ext.Extension):
 
        .. seealso:: http://www.formencode.org/en/latest/htmlfill.html#errors
 
+    .. attribute:: jinja2.Environment.formfill_skeletons
+
+       The :class:`~formencode_jinja2.skeleton.SkeletonCache` of the
+       rendered form bodies.  Each distinct body is tokenized only once
+       into static text and fill slots, later renderings only fill the
+       slots with the defaults and errors.  Set to ``None`` to tokenize the
+       body on every rendering.  Forms are always tokenized when
+       ``formfill_config`` contains a ``listener``.
+
     """
     tags = frozenset(['formfill'])
 
@@ -79,6 +90,7 @@ class FormFillExtension(jinja2.ext.Extension):
         environment.extend(
             formfill_config={},
             formfill_error_formatters=dict(DEFAULT_ERROR_FORMATTERS),
+            formfill_skeletons=SkeletonCache(),
         )
 
     def parse(self, parser):
@@ -105,10 +117,15 @@ class FormFillExtension(jinja2.ext.Extension):
             raise TypeError("argument 'errors' should be collections.Mapping, "
                             "not {0!r}".format(errors))
         rv = caller()
+        config = self.environment.formfill_config
+        formatters = self.environment.formfill_error_formatters
+        skeletons = self.environment.formfill_skeletons
+        if skeletons is not None and 'listener' not in config:
+            return skeletons.get(rv).fill(defaults, errors,
+                                          error_formatters=formatters,
+                                          **config)
         return formencode.htmlfill.render(
-            rv, defaults, errors,
-            error_formatters=self.environment.formfill_error_formatters,
-            **self.environment.formfill_config)
+            rv, defaults, errors, error_formatters=formatters, **config)
 
 
 def default_formatter(error):
@@ -0,0 +1,89 @@
+import collections
+import threading
+
+from formencode.htmlfill import FillingParser, default_formatter, tokenize
+
+
+__all__ = ['FormSkeleton', 'SkeletonCache']
+
+
+class FormSkeleton(object):
+    """HTML form tokenized once into static text and fill slots.
+
+    :meth:`fill` gives the same result as :func:`formencode.htmlfill.render`
+    for the form, but does not tokenize the HTML again.  The static text
+    between the form fields is joined as is, only the slots, the
+    :class:`~formencode.htmlfill.FillTag` tokens, are handled by the
+    :class:`~formencode.htmlfill.FillingParser`.
+
+    :param form: the HTML of the form
+
+    """
+
+    def __init__(self, form):
+        self.form = form
+        self.tokens = tokenize(form)
+
+    def fill(self, defaults=None, errors=None, auto_insert_errors=True,
+             auto_error_formatter=None, **kwargs):
+        """Return the form filled with ``defaults`` and ``errors``.
+
+        Accepts the arguments of :func:`formencode.htmlfill.render` except
+        ``form`` and ``listener``.
+
+        """
+        if defaults is None:
+            defaults = {}
+        if auto_insert_errors and auto_error_formatter is None:
+            auto_error_formatter = default_formatter
+        filler = _SkeletonFiller(self, defaults=defaults, errors=errors,
+                                 auto_error_formatter=auto_error_formatter,
+                                 **kwargs)
+        filler.feed(self.form)
+        filler.close()
+        return filler.text()
+
+
+class SkeletonCache(object):
+    """Thread-safe cache of :class:`FormSkeleton` by form text.
+
+    :param max_items: number of skeletons kept, the least recently used
+                      ones are dropped first
+
+    """
+
+    def __init__(self, max_items=128):
+        self.max_items = max_items
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, form):
+        """Return the skeleton of ``form``, tokenizing it on first use."""
+        with self._lock:
+            skeleton = self._items.pop(form, None)
+            if skeleton is not None:
+                self._items[form] = skeleton
+                return skeleton
+        skeleton = FormSkeleton(form)
+        with self._lock:
+            self._items[form] = skeleton
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return skeleton
+
+
+class _SkeletonFiller(FillingParser):
+    """:class:`~formencode.htmlfill.FillingParser` taking the tokens of a
+    :class:`FormSkeleton` instead of tokenizing the form.
+
+    """
+
+    def __init__(self, skeleton, **kwargs):
+        FillingParser.__init__(self, **kwargs)
+        self.skeleton = skeleton
+
+    def get_tokens(self):
+        return self.skeleton.tokens
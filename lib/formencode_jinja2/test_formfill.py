@@ -1,6 +1,7 @@
 import pytest
 import jinja2
 from formfill import FormFillExtension
+from skeleton import SkeletonCache
 
 
 @pytest.fixture
@@ -227,3 +228,57 @@ def test_undefined_variables(jinja_env):
     </form>'''
     result = jinja_env.from_string(template).render()
     assert result == expected
+
+
+def test_skeleton_reused(jinja_env):
+    template = jinja_env.from_string(u'''
+    {% formfill defaults with errors -%}
+    <form action="account/signin" method="POST">
+        <input type="text" name="username" />
+        <form:error name="username">
+        <input type="password" name="password" />
+    </form>
+    {%- endformfill %}''')
+    expected = u'''
+    <form action="account/signin" method="POST">
+        <input type="text" name="username" value="{0}" />
+        
+        <input type="password" name="password" value="" />
+    </form>'''
+    for username in ['john', 'jane']:
+        result = template.render(defaults={'username': username}, errors={})
+        assert result == expected.format(username)
+    assert len(jinja_env.formfill_skeletons) == 1
+
+
+def test_skeleton_same_as_htmlfill(jinja_env):
+    template = u'''
+    {% formfill defaults with errors -%}
+    <form action="runner/create" method="POST">
+        <form:iferror name="name"><p>Please check the name</p></form:iferror>
+        <input type="text" name="name" />
+        <form:error name="name">
+        <input type="radio" name="gender" value="female" />
+        <input type="radio" name="gender" value="male" checked="checked" />
+        <input type="checkbox" name="paid" value="yes" />
+        <select name="race">
+            <option value="6km" selected="selected">6 km</option>
+            <option value="12km">12 km</option>
+        </select>
+        <textarea name="notes">Nothing &amp; more</textarea>
+    </form>
+    {%- endformfill %}'''
+    cases = [
+        ({}, {}),
+        ({'name': u'J\xf6rg', 'gender': 'female', 'paid': 'yes',
+          'race': '12km', 'notes': '<none>'}, {}),
+        ({'name': 'x'}, {'name': 'Too short', 'gender': 'Required'}),
+    ]
+    for defaults, errors in cases:
+        jinja_env.formfill_skeletons = None
+        expected = jinja_env.from_string(template).render(defaults=defaults,
+                                                          errors=errors)
+        jinja_env.formfill_skeletons = SkeletonCache()
+        result = jinja_env.from_string(template).render(defaults=defaults,
+                                                        errors=errors)
+        assert result == expected
@@ -4,78 +4,127 @@ from __future__ import division, print_function
 
 import StringIO
 import csv
+import datetime
+import functools
+import json
 import logging
 import os.path
 import re
 import textwrap
+import threading
 import urllib
 
+from google.appengine.api import app_identity
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
 from google.appengine.api import users
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import blobstore
 from google.appengine.ext import ndb
+from google.appengine.ext.webapp import blobstore_handlers
 
-import jinja2
 import webapp2
 from webapp2_extras import sessions
 
 import formencode
-import formencode_jinja2
-import xlwt
-from xhtml2pdf import pisa
+
+import ageclass
+import ranking
+import reportcache
+import snapshot
 
 
 # Regex to use for time
-REGEX_TIME = r'^(\d+:)?\d+:\d+'
+REGEX_TIME = r'^(\d+:)?\d+:\d+(\.\d{1,3})?$'
+# Races that can be run at an event
+RACES = ('6km', '12km')
 # Regex to use race
 REGEX_RACE = r'^(6km|12km)$'
 # Regex to use for male/female
 REGEX_GENDER = r'^(male|female)$'
-
-
-class DurationProperty(ndb.StringProperty):
-    """Base type for [hh:]mm:ss durations"""
+# Types of the PDF reports
+REPORT_TYPES = ('starter_list', 'finished', 'certificates')
+# Number of runners to show per page in the event view
+RUNNER_PAGE_SIZE = 50
+# Number of runners to fetch and write at once on export
+EXPORT_BATCH_SIZE = 500
+# Number of rows to flush at once on XLS export, flushing blocks of rows
+# aligned to a power of two keeps xlwt's row dict in row order
+XLS_FLUSH_ROWS = 512
+# Number of runners to write at once on import
+IMPORT_BATCH_SIZE = 500
+
+
+def parse_duration(time_str):
+    """Return milliseconds from [hh:]mm:ss[.fff] duration string"""
+    if not time_str:
+        return None
+    arr = time_str.strip().split(':', 2)
+    secs, _, frac = arr[-1].partition('.')
+    millis = int(secs) * 1000 + int((frac + '000')[:3])
+    if len(arr) == 3:
+        millis += (int(arr[0]) * 60 * 60 + int(arr[1]) * 60) * 1000
+    elif len(arr) == 2:
+        millis += int(arr[0]) * 60 * 1000
+    return millis
+
+
+def format_duration(millis):
+    """Return string displaying milliseconds as hh:mm:ss[.fff]"""
+    if millis is None:
+        return millis
+
+    secs, millis = divmod(int(millis), 1000)
+    mins, secs = divmod(secs, 60)
+    hours, mins = divmod(mins, 60)
+
+    result = '{:02}:{:02}:{:02}'.format(hours, mins, secs)
+    if millis:
+        result += '.{:03}'.format(millis).rstrip('0')
+    return result
+
+
+class DurationProperty(ndb.GenericProperty):
+    """Duration in milliseconds, stored as integer
+
+    Strings in [hh:]mm:ss[.fff] notation are accepted on assignment and in
+    query filters and converted to milliseconds, use format_duration() for
+    display.  Durations stored as strings by earlier versions are converted
+    on load and rewritten by DurationMigrationHandler.
+    """
 
     def _validate(self, value):
-        if not re.match(REGEX_TIME, value):
-            raise TypeError('{} does not match [hh:]mm:ss'.format(value))
-
-    def _to_base_type(self, value):
-        return DurationProperty._display_seconds(
-                DurationProperty._get_seconds_from_time(value))
+        if isinstance(value, basestring):
+            if not re.match(REGEX_TIME, value):
+                raise TypeError('{} does not match [hh:]mm:ss'.format(value))
+            return parse_duration(value)
+        if not isinstance(value, (int, long)):
+            raise TypeError('{!r} is not a duration'.format(value))
+        return int(value)
 
     def _from_base_type(self, value):
+        if isinstance(value, basestring):
+            return parse_duration(value)
         return value
 
-    @staticmethod
-    def _display_seconds(seconds):
-        """Return string displaying seconds as (hours), minutes and seconds
-        """
-        if seconds is None:
-            return seconds
-
-        tmp = int(seconds)
-        secs = tmp % 60
-        tmp = tmp // 60
-        mins = tmp % 60
-        tmp = tmp // 60
-        hours = tmp
-
-        if hours:
-            return '{:02}:{:02}:{:02}'.format(hours, mins, secs)
-        else:
-            return '00:{:02}:{:02}'.format(mins, secs)
 
-    @staticmethod
-    def _get_seconds_from_time(time_str):
-        if not time_str:
-            return None
-        arr = list(map(int, time_str.split(':', 3)))
-        if len(arr) == 3:
-            seconds = arr[0] * 60 * 60 + arr[1] * 60 + arr[0]
-        elif len(arr) == 2:
-            seconds = arr[0] * 60 + arr[1]
-        else:
-            seconds = arr[0]
-        return seconds
+def run_once(func):
+    """Decorator caching the result of func, which takes no arguments
+
+    Used for loading what only some requests need on first use instead of
+    on instance startup.
+    """
+    lock = threading.Lock()
+    result = []
+
+    @functools.wraps(func)
+    def wrapper():
+        if not result:
+            with lock:
+                if not result:
+                    result.append(func())
+        return result[0]
+    return wrapper
 
 
 class VolkslaufException(Exception):
@@ -86,6 +135,10 @@ class MissingConfiguration(VolkslaufException):
     pass
 
 
+class ResultsPending(VolkslaufException):
+    """Raised when reading the Results of an event not counted yet"""
+
+
 def read_session_secret():
     try:
         path = os.path.join(os.path.dirname(__file__), '_session_key')
@@ -96,21 +149,94 @@ def read_session_secret():
                 'Configuration file {} is missing!'.format(path), e)
 
 
+# The session secret is read on first use, see BaseHandler.dispatch()
 CONFIG = {
-    'webapp2_extras.sessions': {
-        'secret_key': read_session_secret(),
-    },
+    'webapp2_extras.sessions': {},
 }
 
 
-JINJA_ENVIRONMENT = jinja2.Environment(
-    loader=jinja2.FileSystemLoader(os.path.dirname(__file__)),
-    extensions=['jinja2.ext.autoescape',
-                'formencode_jinja2.formfill'],
-    undefined=jinja2.StrictUndefined,
-    autoescape=True)
+@run_once
+def get_session_secret():
+    return read_session_secret()
+
+
+# Directory of the template sources
+TEMPLATE_DIR = os.path.dirname(__file__)
+
+# Directory of the templates precompiled by compile_templates.py
+COMPILED_TEMPLATE_DIR = os.path.join(TEMPLATE_DIR, 'compiled_templates')
+
 
-formencode.api.set_stdtranslation(domain='FormEncode', languages=['de'])
+def is_development():
+    """Return whether running in the development server"""
+    return os.environ.get('SERVER_SOFTWARE', '').startswith('Development')
+
+
+def create_jinja_environment(loader, **kwargs):
+    """Return the application's Jinja2 Environment using loader"""
+    import jinja2
+    env = jinja2.Environment(
+        loader=loader,
+        extensions=['jinja2.ext.autoescape',
+                    'formencode_jinja2.formfill'],
+        undefined=jinja2.StrictUndefined,
+        autoescape=True,
+        **kwargs)
+    env.filters['duration'] = format_duration
+    env.globals['age_class_tables'] = ageclass.TABLES
+    env.globals['age_class_table'] = ageclass.get_table
+    return env
+
+
+def jinja_environment_options():
+    """Return loader and caching options for the Jinja2 Environment
+
+    In production, the templates precompiled on deployment are loaded as
+    modules.  Templates missing from them are compiled from source with
+    the bytecode shared through memcache.  Templates only change with a new
+    deployment, so they are not checked for changes.  The development
+    server always compiles from source and reloads changed templates.
+    """
+    import jinja2
+    source_loader = jinja2.FileSystemLoader(TEMPLATE_DIR)
+    if is_development():
+        return {'loader': source_loader}
+    loaders = [source_loader]
+    if os.path.isdir(COMPILED_TEMPLATE_DIR):
+        loaders.insert(0, jinja2.ModuleLoader(COMPILED_TEMPLATE_DIR))
+    prefix = 'jinja2/{}/'.format(os.environ.get('CURRENT_VERSION_ID', ''))
+    return {
+        'loader': jinja2.ChoiceLoader(loaders),
+        'bytecode_cache': jinja2.MemcachedBytecodeCache(memcache.Client(),
+                                                        prefix=prefix),
+        'auto_reload': False,
+    }
+
+
+@run_once
+def get_jinja_environment():
+    """Return the Jinja2 Environment, created on first use"""
+    return create_jinja_environment(**jinja_environment_options())
+
+
+@run_once
+def load_translations():
+    """Switch the formencode messages to German"""
+    formencode.api.set_stdtranslation(domain='FormEncode', languages=['de'])
+
+
+@run_once
+def get_report_renderer():
+    """Return the htmlreports.ReportRenderer, created on first use"""
+    import htmlreports
+    return htmlreports.ReportRenderer()
+
+
+# Cache for generated reports, 32 MB per instance in front of memcache
+REPORT_CACHE = reportcache.ReportCache(32 * 1024 * 1024)
+
+# Rankings of the events with recent finish writes on this instance
+RANKING_CACHE = ranking.RankingCache(16)
 
 
 # Default organization name.
@@ -131,6 +257,20 @@ class RunnerFinishedForm(formencode.Schema):
     time = formencode.validators.Regex(REGEX_TIME, strip=True)
 
 
+class RunnerArrivalForm(formencode.Schema):
+    """Form validation schema for a runner arriving in timing mode
+
+    The arrival is given as the number of milliseconds between recording
+    the entry and sending it, the server computes the arrival time from
+    its own clock.
+    """
+
+    allow_extra_fields = True
+    filter_extra_fields = True
+    start_no = formencode.validators.Int(not_empty=True, min=1)
+    recorded_ago = formencode.validators.Int(not_empty=True, min=0)
+
+
 class EventForm(formencode.Schema):
     """Form validation schema for Event class"""
 
@@ -139,34 +279,187 @@ class EventForm(formencode.Schema):
     title = formencode.validators.UnicodeString(not_empty=True)
     year = formencode.validators.Int(not_empty=True, min=1990, max=2500)
     next_start_no = formencode.validators.Int(not_empty=True, min=1)
+    age_class_rules = formencode.validators.OneOf(sorted(ageclass.TABLES),
+                                                  not_empty=True)
+
+
+class RaceStats(ndb.Model):
+    """Start time and runner counters for one race of an Event
+
+    Stored within the Event and updated in the same transaction as the
+    Runner writes so reading them only takes the Event get().
+    """
+
+    race = ndb.StringProperty(indexed=False)
+    # Time of the start gun (UTC) for computing durations in timing mode
+    start_time = ndb.DateTimeProperty(indexed=False)
+    num_runners = ndb.IntegerProperty(indexed=False, default=0)
+    num_finished = ndb.IntegerProperty(indexed=False, default=0)
+
+    def num_missing(self):
+        return self.num_runners - self.num_finished
 
 
 class Event(ndb.Model):
     """Model for one event such as 'Volkslauf 2011'"""
 
     date = ndb.DateTimeProperty(auto_now_add=True)
+    updated = ndb.DateTimeProperty(auto_now=True, indexed=False)
     year = ndb.IntegerProperty(indexed=False)
     title = ndb.StringProperty(indexed=False)
     next_start_no = ndb.IntegerProperty()
+    # Name of the age class rules, see ageclass.RULES
+    age_class_rules = ndb.StringProperty(indexed=False,
+                                         default=ageclass.DEFAULT_RULES)
+    # Revision of the event data, incremented on each put; runner writes
+    # always put the event as well for updating the counters
+    revision = ndb.IntegerProperty(indexed=False, default=0)
+    # Whether all runners are keyed by start number, see Runner.key_for()
+    runners_keyed = ndb.BooleanProperty(indexed=False, default=False)
+    # Per-race runner counters, empty for events that have never been counted
+    race_stats = ndb.LocalStructuredProperty(RaceStats, repeated=True)
+    # Whether the Results and PlacesPages hold all runners, events counted
+    # before are recounted in the background, see start_recount()
+    results_counted = ndb.BooleanProperty(indexed=False, default=False)
+
+    # Results of the event once loaded by results(), put with the event
+    _results = None
 
     @classmethod
     @ndb.transactional
     def _pre_delete_hook(klass, key):
         ndb.delete_multi(Runner.query(ancestor=key).fetch(keys_only=True))
+        ndb.delete_multi(
+                ReportJob.query(ancestor=key).fetch(keys_only=True))
+        AgeClassJob.key_for(key).delete()
+        ndb.delete_multi(
+                FinishBatch.query(ancestor=key).fetch(keys_only=True))
+        Results.key_for(key).delete()
+        ndb.delete_multi(
+                PlacesPage.query(ancestor=key).fetch(keys_only=True))
 
-    def all_runners(self):
-        """Return Query with all Runner objects for this event"""
-        return Runner.query(Runner.event == self.key,
-                            ancestor=self.key).order(Runner.start_no)
+    def _pre_put_hook(self):
+        self.revision += 1
+        if self._results is not None:
+            self._results.revision = self.revision
+            self._results.put()
 
-    def num_runners(self):
-        return self.all_runners().count()
+    @classmethod
+    @ndb.transactional
+    def recount(klass, key):
+        """Recount the runner counters of the Event from scratch
 
-    def num_missing(self):
-        return len([r for r in self.all_runners() if not r.time])
+        Repairs the counters of events created before the counters were
+        introduced or of events whose counters went out of sync.
+        """
+        event = key.get()
+        event.race_stats = [RaceStats(race=race) for race in RACES]
+        event._results = Results(key=Results.key_for(key))
+        for runner in Runner.query(ancestor=key):
+            event.count_runner(runner)
+        event.results_counted = True
+        event.put()
+        return event
+
+    def start_recount(self):
+        """Enqueue recounting the event by RecountTaskHandler
+
+        The task is named after the revision, so requests reading the
+        event before it has been recounted enqueue it only once.
+        """
+        try:
+            taskqueue.add(name='recount-{}-{}'.format(self.key.urlsafe(),
+                                                      self.revision),
+                          url='/tasks/recount',
+                          params={'event': self.key.urlsafe()})
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            pass
+
+    def runners_by_start_no(self, start_nos):
+        """Return dict with the event's Runner objects for the start numbers
+
+        Start numbers without runner are missing from the result.  Runners
+        are looked up by key, the runners of events that have not been
+        migrated to keys by start number are queried for.
+        """
+        runners = ndb.get_multi([Runner.key_for(self.key, start_no)
+                                 for start_no in start_nos])
+        result = dict((r.start_no, r) for r in runners if r)
+        missing = set(start_nos) - set(result)
+        if missing and not self.runners_keyed:
+            qry = Runner.query(Runner.start_no >= min(missing),
+                               Runner.start_no <= max(missing),
+                               ancestor=self.key)
+            result.update((r.start_no, r) for r in qry
+                          if r.start_no in missing)
+        return result
+
+    @classmethod
+    def query_runners(klass, key):
+        """Return Query with all Runner objects for the event with key"""
+        return Runner.query(Runner.event == key,
+                            ancestor=key).order(Runner.start_no)
+
+    def age_class_table(self):
+        """Return AgeClassTable of the event's age class rules"""
+        return ageclass.get_table(self.age_class_rules)
+
+    def get_race_stats(self, race):
+        """Return RaceStats for the given race, creating it if necessary"""
+        for stats in self.race_stats:
+            if stats.race == race:
+                return stats
+        stats = RaceStats(race=race)
+        self.race_stats.append(stats)
+        return stats
+
+    def results(self):
+        """Return Results of the event, creating them if necessary"""
+        if self._results is None:
+            key = Results.key_for(self.key)
+            self._results = key.get() or Results(key=key)
+        return self._results
+
+    def get_results(self):
+        """Return the event's Results for reading
+
+        Raises ResultsPending for events whose Results have not been
+        counted yet, see start_recount() and ResultsMigrationHandler.
+        """
+        if not self.results_counted:
+            raise ResultsPending('Event {} has not been counted'.format(
+                    self.key.urlsafe()))
+        key = Results.key_for(self.key)
+        return key.get() or Results(key=key)
+
+    def count_runner(self, runner, delta=1):
+        """Add runner to the counters or remove it with delta=-1
+
+        Also updates the snapshot and placings in the event's Results.
+        Must be called in the transaction that writes the runner and the
+        Event must be put afterwards.
+        """
+        stats = self.get_race_stats(runner.race)
+        stats.num_runners += delta
+        if runner.time is not None:
+            stats.num_finished += delta
+        age_class = self.age_class_table().classify(
+                self.year, runner.gender, runner.birth_year)
+        self.results().count_runner(runner, age_class or runner.age_class,
+                                    delta)
 
-    def num_finished(self):
-        return len([r for r in self.all_runners() if r.time])
+    def _race_stats(self, race=None):
+        return [s for s in self.race_stats if not race or s.race == race]
+
+    def num_runners(self, race=None):
+        return sum(s.num_runners for s in self._race_stats(race))
+
+    def num_missing(self, race=None):
+        return sum(s.num_missing() for s in self._race_stats(race))
+
+    def num_finished(self, race=None):
+        return sum(s.num_finished for s in self._race_stats(race))
 
     def percent_done(self):
         if not self.num_runners():
@@ -194,8 +487,8 @@ class UniqueStartNoValidator(formencode.FancyValidator):
     }
 
     def validate_python(self, value, state):
-        runner = Runner.query(Runner.start_no == value,
-                              ancestor=state.event_key).get()
+        event = state.event_key.get()
+        runner = event.runners_by_start_no([value]).get(value)
         if runner and runner.key != state.runner_key:
             raise formencode.Invalid(self.message('exists', state),
                                      value, state)
@@ -216,6 +509,17 @@ class RunnerForm(formencode.Schema):
     gender = formencode.validators.Regex(REGEX_GENDER, not_empty=True)
     birth_year = formencode.validators.Int(not_empty=True, min=1900)
     race = formencode.validators.Regex(REGEX_RACE, not_empty=True, strip=True)
+    time = formencode.validators.Regex(REGEX_TIME, strip=True,
+                                       if_missing=None)
+
+
+def runner_to_tsv(runner, sep=u'\t'):
+    """Return TSV line of a snapshot.Row as unicode"""
+    vals = [runner.start_no, runner.name, runner.team, runner.birth_year,
+            runner.gender, runner.age_class, runner.race,
+            format_duration(runner.time)]
+    vals = [v if v is not None else u'' for v in vals]
+    return sep.join(map(unicode, vals)) + u'\n'
 
 
 class Runner(ndb.Model):
@@ -233,13 +537,25 @@ class Runner(ndb.Model):
     time = DurationProperty(indexed=True)
     race = ndb.StringProperty(indexed=True)
 
-    def to_tsv(self, sep='\t'):
-        """Convert to TSV representation"""
-        vals = [self.start_no, self.name, self.team, self.birth_year,
-                self.gender, self.age_class, self.race,
-                self.time]
-        vals = [v if v is not None else '' for v in vals]
-        return sep.join(map(str, vals)) + '\n'
+    # Event of the runner if known to the writer, saves the event get()
+    _event = None
+
+    @classmethod
+    def key_for(klass, event_key, start_no):
+        """Return key of the runner with start_no in the event
+
+        Runners are keyed by start number, so the key also ensures that
+        start numbers are unique.  Runners of events created before have
+        integer ids until migrated by RunnerKeyMigrationHandler.
+        """
+        return ndb.Key(klass, str(start_no), parent=event_key)
+
+    def rekeyed(self):
+        """Return copy of runner with key matching its start number"""
+        runner = Runner(key=Runner.key_for(self.key.parent(), self.start_no),
+                        **self.to_dict())
+        runner._event = self._event
+        return runner
 
     def _pre_put_hook(self):
         age_class = self._compute_age_class()
@@ -247,53 +563,250 @@ class Runner(ndb.Model):
             self.age_class = age_class
 
     def _compute_age_class(self):
-        if not self.birth_year or self.gender not in ['male', 'female']:
-            return None
-        age = self.event.get().year - self.birth_year
-
-        gender = 'M' if self.gender == 'male' else 'W'
-        result = gender
-
-        if age < 16:
-            result += 'S '
-            if age <= 9:
-                result += 'D'
-            elif age <= 11:
-                result += 'C'
-            elif age <= 13:
-                result += 'B'
-            elif age <= 15:
-                result += 'A'
-        elif age < 20:
-            result += 'JG '
-            if age <= 17:
-                result += 'B'
-            elif age <= 19:
-                result += 'A'
-        else:
-            result = 'L' + gender
-
-            if age <= 29:
-                result += '20'
-            elif age <= 34:
-                result += '30'
-            elif age <= 39:
-                result += '35'
-            elif age <= 44:
-                result += '40'
-            elif age <= 49:
-                result += '45'
-            elif age <= 54:
-                result += '50'
-            elif age <= 59:
-                result += '55'
-            elif age <= 64:
-                result += '60'
-            elif age <= 69:
-                result += '65'
+        event = self._event or self.event.get()
+        return event.age_class_table().classify(
+                event.year, self.gender, self.birth_year)
+
+
+class FinishBatch(ndb.Model):
+    """Results of a batch of finish records, child of the Event
+
+    The id is the idempotency key sent by the timing station, so a retried
+    batch returns the stored results instead of being applied again.
+    """
+
+    date = ndb.DateTimeProperty(auto_now_add=True)
+    results = ndb.JsonProperty()
+
+
+class Results(ndb.Model):
+    """Packed snapshot and placings of an Event's runners, child of the Event
+
+    Updated by Event.count_runner() in the transactions writing the
+    runners, so reports and exports read one entity instead of querying
+    the runners, and look up the places instead of sorting the field.
+    """
+
+    # Id of the results within their event
+    ID = 'results'
+
+    # Runners packed by snapshot.Snapshot.pack()
+    snapshot = ndb.BlobProperty(compressed=True)
+    # Places as [start_no, overall, gender, age_class]
+    places = ndb.JsonProperty(compressed=True)
+    # Revision of the Event the results were put with
+    revision = ndb.IntegerProperty(indexed=False, default=0)
+
+    _snapshot = None
+    _ranking = None
+
+    @classmethod
+    def key_for(klass, event_key):
+        return ndb.Key(klass, klass.ID, parent=event_key)
+
+    def get_snapshot(self):
+        """Return the unpacked snapshot.Snapshot"""
+        if self._snapshot is None:
+            if self.snapshot:
+                self._snapshot = snapshot.Snapshot.unpack(self.snapshot)
             else:
-                result += '70'
-        return result
+                self._snapshot = snapshot.Snapshot()
+        return self._snapshot
+
+    def ranking(self):
+        """Return the ranking.Ranking for updating the places
+
+        Taken from RANKING_CACHE if this instance wrote the results last,
+        otherwise rebuilt from the snapshot.
+        """
+        if self._ranking is None:
+            self._ranking = RANKING_CACHE.take(self.key, self.revision)
+        if self._ranking is None:
+            self._ranking = ranking.Ranking(
+                    (row.race, row.time, row.start_no, row.gender,
+                     row.age_class)
+                    for row in self.get_snapshot().finished_rows())
+        return self._ranking
+
+    def count_runner(self, runner, age_class, delta):
+        """Add runner with age_class or remove it with delta=-1"""
+        snapshot_ = self.get_snapshot()
+        ranking_ = self.ranking()
+        if delta < 0:
+            snapshot_.remove(runner.start_no)
+            ranking_.remove(runner.start_no)
+            return
+        snapshot_.add(snapshot.Row(
+                runner.start_no, runner.name, runner.team, runner.gender,
+                runner.birth_year, age_class, runner.race, runner.time))
+        if runner.time is None:
+            ranking_.remove(runner.start_no)
+        else:
+            ranking_.add(runner.start_no, runner.race, runner.time,
+                         runner.gender, age_class)
+
+    def get_places(self):
+        """Return dict with (overall, gender, age_class) place by start_no"""
+        if self._ranking is not None:
+            return self._ranking.places()
+        return dict((p[0], tuple(p[1:])) for p in self.places or [])
+
+    def _pre_put_hook(self):
+        if self._snapshot is not None:
+            self.snapshot = self._snapshot.pack()
+        if self._ranking is not None:
+            places = self._ranking.places()
+            old = None
+            if self.places is not None:
+                old = dict((p[0], tuple(p[1:])) for p in self.places)
+            PlacesPage.update(self.key.parent(), old, places)
+            self.places = [[start_no] + list(places_) for start_no, places_
+                           in sorted(places.items())]
+            key, revision, ranking_ = self.key, self.revision, self._ranking
+            ndb.get_context().call_on_commit(
+                    lambda: RANKING_CACHE.put(key, revision, ranking_))
+
+
+class PlacesPage(ndb.Model):
+    """Places of the runners in one block of start numbers, child of the Event
+
+    Written with the Results for the blocks whose places changed, so the
+    event view looks up the places of its page of runners by key instead
+    of loading the Results with the places of all runners.
+    """
+
+    # Number of start numbers per page
+    SIZE = 100
+
+    # Places as [start_no, overall, gender, age_class]
+    places = ndb.JsonProperty()
+
+    @classmethod
+    def key_for(klass, event_key, start_no):
+        return ndb.Key(klass, str(start_no // klass.SIZE), parent=event_key)
+
+    @classmethod
+    @ndb.tasklet
+    def get_places_async(klass, event_key, start_nos):
+        """Return Future of dict with the places of start_nos
+
+        Like Results.get_places(), start numbers without place are missing.
+        """
+        keys = set(klass.key_for(event_key, s) for s in start_nos)
+        pages = yield ndb.get_multi_async(list(keys))
+        raise ndb.Return(dict((p[0], tuple(p[1:])) for page in pages if page
+                              for p in page.places))
+
+    @classmethod
+    def update(klass, event_key, old, new):
+        """Write the pages of the start numbers whose places changed
+
+        The places are dicts as returned by Results.get_places().  Without
+        old places all pages are written, pages without places are deleted.
+        """
+        pages = {}
+        for start_no, places in new.iteritems():
+            pages.setdefault(klass.key_for(event_key, start_no), []).append(
+                    [start_no] + list(places))
+        if old is None:
+            keys = set(klass.query(ancestor=event_key).fetch(keys_only=True))
+            keys.update(pages)
+        else:
+            keys = set(klass.key_for(event_key, start_no)
+                       for start_no in set(old) | set(new)
+                       if old.get(start_no) != new.get(start_no))
+        ndb.put_multi([klass(key=key, places=sorted(pages[key]))
+                       for key in keys if key in pages])
+        ndb.delete_multi([key for key in keys if key not in pages])
+
+
+class AgeClassJob(ndb.Model):
+    """Progress of recomputing the age classes of an Event's runners
+
+    There is one job per event, child of the Event.  Each restart increments
+    the generation, tasks of an earlier generation stop on their next batch.
+    """
+
+    # Id of the job within its event
+    ID = 'age_classes'
+
+    generation = ndb.IntegerProperty(indexed=False, default=0)
+    num_processed = ndb.IntegerProperty(indexed=False, default=0)
+    num_changed = ndb.IntegerProperty(indexed=False, default=0)
+    done = ndb.BooleanProperty(indexed=False, default=False)
+
+    @classmethod
+    def key_for(klass, event_key):
+        return ndb.Key(klass, klass.ID, parent=event_key)
+
+    @classmethod
+    def start(klass, event_key):
+        """(Re)start recomputing, must be called in a transaction"""
+        job = klass.key_for(event_key).get() or klass(
+                key=klass.key_for(event_key))
+        job.populate(generation=job.generation + 1, num_processed=0,
+                     num_changed=0, done=False)
+        job.put()
+        taskqueue.add(url='/tasks/age_classes',
+                      params={'event': event_key.urlsafe(),
+                              'generation': job.generation},
+                      transactional=True)
+        return job
+
+
+class EventViewData(object):
+    """Event together with one page of its runners
+
+    The stats are taken from the event's runner counters, so the cost of
+    the view does not depend on the number of runners.
+    """
+
+    def __init__(self, event, runners, cursor, more, age_class_job=None,
+                 places=None):
+        self.event = event
+        self.runners = runners
+        # Places by start number, see Results.get_places()
+        self.places = places or {}
+        self.cursor = cursor
+        self.more = more
+        self.age_class_job = age_class_job
+        self.num_runners = event.num_runners()
+        self.num_finished = event.num_finished()
+        self.num_missing = event.num_missing()
+
+    def next_cursor(self):
+        """Return urlsafe cursor to the next page or None on the last one"""
+        if self.more and self.cursor:
+            return self.cursor.urlsafe()
+        return None
+
+    def percent_done(self):
+        return self.event.percent_done()
+
+
+@ndb.tasklet
+def load_event_view_async(event_key, cursor=None,
+                          page_size=RUNNER_PAGE_SIZE):
+    """Load event and a page of its runners in parallel
+
+    Returns a Future of EventViewData, the page starts at the given
+    Cursor or at the first runner.  Only the places of the page's runners
+    are loaded.  Events not counted yet are shown without places while
+    they are recounted in the background.
+    """
+    event, job, (runners, next_cursor, more) = yield (
+            event_key.get_async(),
+            AgeClassJob.key_for(event_key).get_async(),
+            Event.query_runners(event_key).fetch_page_async(
+                page_size, start_cursor=cursor))
+    places = {}
+    if event.results_counted:
+        places = yield PlacesPage.get_places_async(
+                event_key, [runner.start_no for runner in runners])
+    else:
+        event.start_recount()
+    raise ndb.Return(EventViewData(event, runners, next_cursor, more, job,
+                                   places))
 
 
 class BaseHandler(webapp2.RequestHandler):
@@ -304,6 +817,11 @@ class BaseHandler(webapp2.RequestHandler):
     """
 
     def dispatch(self):
+        session_config = self.app.config['webapp2_extras.sessions']
+        if 'secret_key' not in session_config:
+            session_config['secret_key'] = get_session_secret()
+        if self.request.method != 'GET':
+            load_translations()
         # Get a session store for this request
         self.session_store = sessions.get_store(request=self.request)
         try:
@@ -323,12 +841,25 @@ class BaseHandler(webapp2.RequestHandler):
         """
         tpl_values2 = dict(self._default_tpl_values())
         tpl_values2.update(tpl_values)
-        template = JINJA_ENVIRONMENT.get_template(tpl_path)
+        template = get_jinja_environment().get_template(tpl_path)
         res = template.render(tpl_values2)
         if write_response:
             self.response.write(res)
         return res
 
+    def _redirect_results_pending(self, event):
+        """Recount event in the background, redirect to its view"""
+        event.start_recount()
+        self.session.add_flash('Die Ergebnisse werden gerade gezaehlt, '
+                               'bitte spaeter erneut versuchen.',
+                               key='error')
+        self.redirect('/event/view/{}'.format(event.key.urlsafe()))
+
+    def _write_json(self, value):
+        """Write value JSON-encoded to the client"""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(value))
+
     def _default_tpl_values(self):
         """"Return dict with default template values"""
         vals = {
@@ -340,6 +871,102 @@ class BaseHandler(webapp2.RequestHandler):
         return vals
 
 
+class TsvImporter(object):
+    """Imports an event with its runners from the TSV export format
+
+    The file is parsed and all runners are validated first, an invalid row
+    raises formencode.Invalid before anything is written.  The runners are
+    then written with put_multi_async() in batches of batch_size, at most
+    max_pending batches at a time.  The Event itself is put in a single
+    transaction after all runners have been written, so it only shows up
+    once complete.
+    """
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE, max_pending=4):
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+
+    def run(self, tsv_text):
+        """Import event from tsv_text, return key of the new Event"""
+        start, _ = Event.allocate_ids(1, parent=organization_key())
+        event = Event(id=start, parent=organization_key(),
+                      race_stats=[RaceStats(race=race) for race in RACES],
+                      runners_keyed=True, results_counted=True)
+        if isinstance(tsv_text, unicode):
+            tsv_text = tsv_text.encode('utf-8')
+        rows = self._parse(event, StringIO.StringIO(tsv_text))
+        runners = self._make_runners(event, rows)
+
+        pending = []
+        for i in xrange(0, len(runners), self.batch_size):
+            batch = runners[i:i + self.batch_size]
+            for runner in batch:
+                event.count_runner(runner)
+            pending.append(ndb.put_multi_async(batch))
+            if len(pending) == self.max_pending:
+                ndb.Future.wait_all(pending.pop(0))
+        for futures in pending:
+            ndb.Future.wait_all(futures)
+
+        return ndb.transaction(event.put)
+
+    def _parse(self, event, f):
+        """Read header into event, return (line_no, row) of the runner rows"""
+        rows = []
+        for line_no, row in enumerate(csv.reader(f, delimiter='\t'), 1):
+            row = [x.decode('utf-8') for x in row]
+            if not row:
+                continue
+            elif row[0] == '#title:':
+                event.title = row[1]
+            elif row[0] == '#year:':
+                event.year = int(row[1])
+            elif row[0] == '#next_start_no:':
+                event.next_start_no = int(row[1])
+            elif row[0] == '#age_class_rules:':
+                event.age_class_rules = row[1]
+            elif row[0] == '#start_no':  # header
+                pass
+            else:
+                rows.append((line_no, row))
+        return rows
+
+    def _make_runners(self, event, rows):
+        """Return list of the Runners of rows
+
+        Raises formencode.Invalid for the first invalid row or duplicate
+        start number.
+        """
+        runners = []
+        start_nos = set()
+        for line_no, row in rows:
+            runner = self._make_runner(event, line_no, row)
+            if runner.start_no in start_nos:
+                raise formencode.Invalid(
+                        'Zeile {}: Startnr. {} ist doppelt vergeben'.format(
+                            line_no, runner.start_no), row, None)
+            start_nos.add(runner.start_no)
+            runners.append(runner)
+        return runners
+
+    def _make_runner(self, event, line_no, row):
+        try:
+            runner = Runner(key=Runner.key_for(event.key, int(row[0])))
+            runner.event = event.key
+            runner.start_no = int(row[0])
+            runner.name = row[1]
+            runner.team = row[2]
+            runner.birth_year = int(row[3])
+            runner.gender = row[4]
+            runner.race = row[6]
+            runner.time = row[7] or None
+        except (ValueError, TypeError, IndexError):
+            raise formencode.Invalid(
+                    'Zeile {} ist ungueltig'.format(line_no), row, None)
+        runner._event = event
+        return runner
+
+
 class EventImportHandler(BaseHandler):
     """Handler for importing events
 
@@ -359,41 +986,21 @@ class EventImportHandler(BaseHandler):
             self._render('event/import.html', {})
             return
 
-        event_key = self._import_from_tsv(self.request.get('tsv_file'))
+        try:
+            event_key = self._import_from_tsv(self.request.get('tsv_file'))
+        except (VolkslaufException, formencode.Invalid, ValueError,
+                IndexError), e:
+            msg = 'Import fehlgeschlagen: {}'.format(e)
+            self.session.add_flash(msg, key='error')
+            self._render('event/import.html', {})
+            return
         event = event_key.get()
         tpl = 'Der Lauf {} wurde erfolgreich importiert.'
         self.session.add_flash(tpl.format(event.title), key='info')
         self.redirect('/event/view/{}'.format(event_key.urlsafe()))
 
-    @ndb.transactional
     def _import_from_tsv(self, tsv_text):
-        event = Event(parent=organization_key())
-        f = StringIO.StringIO(str(tsv_text))
-        csvfile = csv.reader(f, delimiter='\t')
-        for row in csvfile:
-            if row[0] == '#title:':
-                event.title = row[1]
-            elif row[0] == '#year:':
-                event.year = int(row[1])
-            elif row[0] == '#next_start_no:':
-                event.next_start_no = int(row[1])
-            elif row[0] == '#start_no':  # header
-                event_key = event.put()
-            else:
-                self._import_row(event_key, row)
-        return event_key
-
-    def _import_row(self, event_key, row):
-        runner = Runner(parent=event_key)
-        runner.event = event_key
-        runner.start_no = int(row[0])
-        runner.name = row[1]
-        runner.team = row[2]
-        runner.birth_year = int(row[3])
-        runner.gender = row[4]
-        runner.race = row[6]
-        runner.time = row[7]
-        runner.put()
+        return TsvImporter().run(tsv_text)
 
 
 class EventListHandler(BaseHandler):
@@ -427,7 +1034,10 @@ class EventCreateHandler(BaseHandler):
         try:
             form = EventForm()
             form_result = form.to_python(dict(self.request.params))
-            event = Event(parent=organization_key(), **form_result)
+            event = Event(parent=organization_key(),
+                          race_stats=[RaceStats(race=race) for race in RACES],
+                          runners_keyed=True, results_counted=True,
+                          **form_result)
             event_key = event.put()
             self.redirect('/event/view/{}'.format(event_key.urlsafe()))
             # Send success method into flash
@@ -455,28 +1065,137 @@ class EventUpdateHandler(BaseHandler):
             return
 
         event_key = ndb.Key(urlsafe=event_key)
-        event = event_key.get()
 
         try:
-            form = EventForm()
-            event.populate(**form.to_python(dict(self.request.params)))
-            event.put()
+            self._update_event(event_key)
             self.redirect('/event/view/{}'.format(event_key.urlsafe()))
         except formencode.Invalid, e:
             self._render('event/update.html',
                          {'event': e.value, 'errors': e.error_dict})
 
+    @ndb.transactional
+    def _update_event(self, event_key):
+        """Update event in a transactional fashion
+
+        Keeps the runner counters written concurrently by other requests
+        and starts recomputing the age classes if year or rules changed.
+        """
+        event = event_key.get()
+        old = (event.year, event.age_class_rules)
+        form = EventForm()
+        event.populate(**form.to_python(dict(self.request.params)))
+        if (event.year, event.age_class_rules) != old:
+            AgeClassJob.start(event_key)
+        return event.put()
+
 
 class EventViewHandler(BaseHandler):
     """Handler for viewing one event"""
 
     def get(self, event_key):
-        event = ndb.Key(urlsafe=event_key).get()
+        data = load_event_view_async(ndb.Key(urlsafe=event_key)).get_result()
         self._render('event/view.html',
-                     {'event': event,
-                      'percent_done': event.percent_done(),
-                      'num_missing': event.num_missing(),
-                      'num_finished': event.num_finished()})
+                     {'event': data.event,
+                      'runners': data.runners,
+                      'places': data.places,
+                      'next_cursor': data.next_cursor(),
+                      'age_class_job': data.age_class_job,
+                      'percent_done': data.percent_done(),
+                      'num_runners': data.num_runners,
+                      'num_missing': data.num_missing,
+                      'num_finished': data.num_finished})
+
+
+class EventStartHandler(BaseHandler):
+    """Handler for recording the start gun time of a race
+
+    The start time is taken from the server clock, a start that has been
+    recorded before must be reset first.
+    """
+
+    def post(self, event_key, race):
+        if race not in RACES:
+            self.abort(404)
+        now = datetime.datetime.utcnow()
+        event_key = ndb.Key(urlsafe=event_key)
+        if self.request.get('submit_reset'):
+            self._set_start_time(event_key, race, None)
+            msg = 'Start fuer {} zurueckgesetzt.'.format(race)
+            self.session.add_flash(msg, key='info')
+        elif self._set_start_time(event_key, race, now):
+            msg = 'Start fuer {} um {} UTC erfasst.'.format(
+                    race, now.strftime('%H:%M:%S'))
+            self.session.add_flash(msg, key='info')
+        else:
+            msg = 'Der Start fuer {} wurde bereits erfasst.'.format(race)
+            self.session.add_flash(msg, key='error')
+        self.redirect('/event/view/{}'.format(event_key.urlsafe()))
+
+    @ndb.transactional
+    def _set_start_time(self, event_key, race, start_time):
+        """Set start time of race, return False if set before"""
+        event = event_key.get()
+        stats = event.get_race_stats(race)
+        if start_time and stats.start_time:
+            return False
+        stats.start_time = start_time
+        event.put()
+        return True
+
+
+class EventRunnersHandler(BaseHandler):
+    """Handler for loading the next page of the event view's runner table
+
+    Returns a JSON object with the rendered table rows and the cursor to
+    the following page.
+    """
+
+    def get(self, event_key):
+        cursor = self.request.get('cursor')
+        cursor = Cursor(urlsafe=cursor) if cursor else None
+        data = load_event_view_async(ndb.Key(urlsafe=event_key),
+                                     cursor).get_result()
+        template = get_jinja_environment().get_template(
+                'event/_runner_rows.html')
+        self._write_json({
+            'html': template.render({'event': data.event,
+                                     'runners': data.runners,
+                                     'places': data.places}),
+            'cursor': data.next_cursor(),
+        })
+
+
+class EventRosterHandler(BaseHandler):
+    """Handler returning the compact roster of an event as JSON
+
+    Maps start numbers to [name, race, finished] so the finish line page can
+    validate entries without a round trip.  Clients send the ETag of their
+    copy and get 304 while the event is unchanged.
+    """
+
+    def get(self, event_key):
+        event = ndb.Key(urlsafe=event_key).get()
+        etag = 'roster-{}'.format(event.revision)
+        if etag in self.request.if_none_match:
+            self.response.status = 304
+            return
+        qry = Runner.query(ancestor=event.key).order(Runner.start_no)
+        runners = {}
+        for runner in qry.iter(projection=[Runner.start_no, Runner.name,
+                                           Runner.race, Runner.time],
+                               batch_size=EXPORT_BATCH_SIZE):
+            runners[runner.start_no] = [runner.name, runner.race,
+                                        runner.time is not None]
+        self.response.etag = etag
+        self._write_json({'revision': event.revision, 'runners': runners})
+
+
+class EventFinishLineHandler(BaseHandler):
+    """Handler for the offline-tolerant finish line page"""
+
+    def get(self, event_key):
+        event = ndb.Key(urlsafe=event_key).get()
+        self._render('event/finish_line.html', {'event': event})
 
 
 class EventDeleteHandler(BaseHandler):
@@ -500,81 +1219,123 @@ class EventDeleteHandler(BaseHandler):
             self.redirect('/event/view/{}'.format(event_key))
 
 
-class EventReportHandler(BaseHandler):
-    """Handler for generating a report"""
+class EventRecountHandler(BaseHandler):
+    """Handler for recounting the runner counters of one event"""
 
-    def get(self, event_key, report_type):
-        event_key = ndb.Key(urlsafe=event_key)
-        event = event_key.get()
+    def post(self, event_key):
+        event = Event.recount(ndb.Key(urlsafe=event_key))
+        msg = 'Die Laeufer des Laufs {} wurden neu gezaehlt.'.format(
+                event.title)
+        self.session.add_flash(msg, key='info')
+        self.redirect('/event/view/{}'.format(event.key.urlsafe()))
+
+
+class ReportGenerator(object):
+    """Generates the PDF reports of an event
+
+    The report parameters (race, order, by, ...) are given as dict, so
+    reports can be generated in the request as well as in the background
+    by ReportTaskHandler.  The runners are read from the event's Results
+    snapshot, which are loaded unless given.
+    """
+
+    def __init__(self, event, params, results=None):
+        self.event = event
+        self.params = params
+        self.results = results or event.get_results()
+
+    def render(self, report_type):
+        """Render report of the given type, return PDF data"""
         if report_type == 'starter_list':
-            self._get_starter_list(event_key, event)
+            return self._get_starter_list()
         elif report_type == 'finished':
-            self._get_finished_list(event_key, event)
+            return self._get_finished_list()
         elif report_type == 'certificates':
-            self._get_certificates(event_key, event)
+            return self._get_certificates()
+        else:
+            raise ValueError('Unknown report type {}'.format(report_type))
 
-    def _render_pdf(self, template, values, filename='download.pdf'):
-        """Render PDF for download"""
-        html = self._render(template, values, write_response=False)
-        out = StringIO.StringIO()
-        pdf = pisa.CreatePDF(html, out, encoding='utf-8')
-        self.response.headers['Content-Type'] = 'application/pdf'
-        disp = 'attachment; filename={}'.format(filename)
-        #self.response.headers['Content-Disposition'] = disp
-        self.response.out.write(pdf.dest.getvalue())
+    def _use_html(self):
+        """Return whether to render lists from the HTML templates
+
+        Lists are rendered directly with ReportLab by pdflists, rendering
+        the templates with xhtml2pdf is kept as fallback selected by the
+        parameter renderer=html.
+        """
+        return self.params.get('renderer') == 'html'
+
+    def _render_pdf(self, template, values):
+        """Render PDF, return its data"""
+        html = get_jinja_environment().get_template(template).render(values)
+        return get_report_renderer().render(html)
 
-    def _get_starter_list(self, event_key, event):
+    def _get_starter_list(self):
         # Get filter / order from query string
-        race = self.request.get('race')
-        order = self.request.get('order')
-        if race:
-            qry = Runner.query(
-                    Runner.event == event_key and Runner.race == race,
-                    ancestor=event_key)
-        else:
-            qry = Runner.query(Runner.event == event_key,
-                               ancestor=event_key)
+        race = self.params.get('race')
+        order = self.params.get('order')
+        runners = list(self.results.get_snapshot().rows(race))
         if order == 'name':
-            qry = qry.order(Runner.name)
-        else:
-            qry = qry.order(Runner.start_no)
+            runners.sort(key=lambda x: x.name)
         # Render results 
+        if not self._use_html():
+            import pdflists
+            title = u'Starterliste {}'.format(self.event.title)
+            if race:
+                title += u' ({})'.format(race.replace('km', ' km'))
+            rows = [(r.start_no, r.name, r.team,
+                     'm' if r.gender == 'male' else 'w', r.age_class, r.race)
+                    for r in runners]
+            return pdflists.render(title, pdflists.STARTER_COLUMNS,
+                                   [pdflists.Section([], rows)])
         vals = {
-            'event': event,
+            'event': self.event,
             'race': race,
             'order': order,
-            'runners': qry,
+            'runners': runners,
         }
-        self._render_pdf('/event/report_starter_list.html', vals)
-
-    def _get_finished_list(self, event_key, event):
-        # Query for the runners
-        race = self.request.get('race')
-        if race:
-            qry = Runner.query(
-                    Runner.event == event_key and
-                    Runner.time != None and
-                    Runner.race == race,
-                    ancestor=event_key)
-        else:
-            qry = Runner.query(Runner.event == event_key and
-                               Runner.time != None,
-                               ancestor=event_key)
-        qry = qry.order(Runner.time)
+        return self._render_pdf('event/report_starter_list.html', vals)
+
+    def _get_finished_list(self):
+        # Select the runners
+        race = self.params.get('race')
+        runners = self.results.get_snapshot().finished_rows(
+                race, parse_duration(self.params.get('time_from')),
+                parse_duration(self.params.get('time_to')))
         # Factorize by the properties that we are interested in
-        bys = self.request.get('by', '').split(',') or []
+        bys = self.params.get('by', '').split(',') or []
         if 'gender' in bys and 'age_class' in bys:
-            self._get_finished_list_gender_age_class(
-                    event_key, event, race, qry)
+            return self._get_finished_list_gender_age_class(race, runners)
         elif 'gender' in bys:
-            self._get_finished_list_gender(event_key, event, race, qry)
+            return self._get_finished_list_gender(race, runners)
         else:
-            self._get_finished_list_all(event_key, event, race, qry)
+            return self._get_finished_list_all(race, runners)
 
-    def _get_finished_list_gender_age_class(
-            self, event_key, event, race, qry):
+    def _render_finished_list(self, groups, place_index):
+        """Render finished list with pdflists, return its data
+
+        The groups are (race, heading, runners) with optional heading, the
+        place at place_index of the runners' places is shown.
+        """
+        import pdflists
+        places = self.results.get_places()
+        sections = []
+        last_race = None
+        for race, heading, runners in groups:
+            headings = []
+            if race != last_race:
+                headings.append((2, u'Strecke: {}'.format(race)))
+                last_race = race
+            if heading:
+                headings.append((3, heading))
+            rows = [(places[r.start_no][place_index], r.name, r.team,
+                     r.age_class, format_duration(r.time)) for r in runners]
+            sections.append(pdflists.Section(headings, rows))
+        return pdflists.render(u'Zieleinlaufliste',
+                               pdflists.FINISHED_COLUMNS, sections)
+
+    def _get_finished_list_gender_age_class(self, race, rows):
         runners = {}
-        for runner in qry:
+        for runner in rows:
             runners.setdefault(runner.race, {})
             runners[runner.race].setdefault(runner.gender, {})
             runners[runner.race][runner.gender].setdefault(
@@ -582,77 +1343,353 @@ class EventReportHandler(BaseHandler):
             runners[runner.race][runner.gender][runner.age_class].append(
                     runner)
         # Render results
+        if not self._use_html():
+            return self._render_finished_list(
+                    [(race_, u'Geschlecht: {}, Altersklasse: {}'.format(
+                        'm' if gender == 'male' else 'w', age_class), group)
+                     for race_, runners2 in runners.iteritems()
+                     for gender, runners3 in runners2.iteritems()
+                     for age_class, group in runners3.iteritems()], 2)
         vals = {
-            'event': event,
+            'event': self.event,
             'race': race,
             'runners': runners,
+            'places': self.results.get_places(),
         }
-        self._render_pdf('/event/report_finished_age_class.html', vals)
+        return self._render_pdf('event/report_finished_age_class.html', vals)
 
-    def _get_finished_list_gender(self, event_key, event, race, qry):
+    def _get_finished_list_gender(self, race, rows):
         runners = {}
-        for runner in qry:
+        for runner in rows:
             runners.setdefault(runner.race, {})
             runners[runner.race].setdefault(runner.gender, [])
             runners[runner.race][runner.gender].append(runner)
         # Render results
+        if not self._use_html():
+            return self._render_finished_list(
+                    [(race_, u'Geschlecht: {}'.format(
+                        'm' if gender == 'male' else 'w'), group)
+                     for race_, runners2 in runners.iteritems()
+                     for gender, group in runners2.iteritems()], 1)
         vals = {
-            'event': event,
+            'event': self.event,
             'race': race,
             'runners': runners,
+            'places': self.results.get_places(),
         }
-        self._render_pdf('/event/report_finished_gender.html', vals)
+        return self._render_pdf('event/report_finished_gender.html', vals)
 
-    def _get_finished_list_all(self, event_key, event, race, qry):
+    def _get_finished_list_all(self, race, rows):
         # Factorize results
         runners = {}
-        for runner in qry:
+        for runner in rows:
             runners.setdefault(runner.race, [])
             runners[runner.race].append(runner)
         # Render results
+        if not self._use_html():
+            return self._render_finished_list(
+                    [(race_, None, group)
+                     for race_, group in runners.iteritems()], 0)
         vals = {
-            'event': event,
+            'event': self.event,
             'race': race,
             'runners': runners,
+            'places': self.results.get_places(),
         }
-        self._render_pdf('/event/report_finished_all.html', vals)
-
-    def _get_certificates(self, event_key, event):
-        # Query for the runners
-        race = self.request.get('race')
-        if race:
-            qry = Runner.query(
-                    Runner.event == event_key and
-                    Runner.time != None and
-                    Runner.race == race,
-                    ancestor=event_key)
-        else:
-            qry = Runner.query(Runner.event == event_key and
-                               Runner.time != None,
-                               ancestor=event_key)
-        # Fetch and sort by start no
-        runners = [r for r in qry.fetch()]
-        runners = sorted(runners, key=lambda x: x.start_no)
-        # Render results
-        from reportlab.pdfgen import canvas
-        from reportlab.lib import pagesizes
-        from reportlab.lib import units
-        from reportlab.pdfbase import pdfmetrics
-        from reportlab.pdfbase.ttfonts import TTFont
-        cm = units.cm
-        buf = StringIO.StringIO()
-        pdfmetrics.registerFont(TTFont('Vera', 'Vera.ttf'))
-        c = canvas.Canvas(buf, pagesize=pagesizes.A4)
-        c.setFont('Vera', 14)
-        for runner in runners:
-            c.drawCentredString(10 * cm, 10 * cm, runner.name)
-            c.drawCentredString(10 * cm, 20 * cm, runner.time)
-            c.showPage()
-        c.save()
+        return self._render_pdf('event/report_finished_all.html', vals)
+
+    def _get_certificates(self):
+        import certificates
+        return certificates.render(self.get_certificates(), self.event.title)
+
+    def get_certificates(self, first=None, last=None):
+        """Return certificates.Certificate list ordered by start number
+
+        Optionally restricted to the start numbers within [first, last].
+        """
+        import certificates
+        race = self.params.get('race')
+        places = self.results.get_places()
+        result = []
+        for row in self.results.get_snapshot().rows(race):
+            if row.time is None:
+                continue
+            if first is not None and not first <= row.start_no <= last:
+                continue
+            place, _, age_class_place = places.get(row.start_no,
+                                                   (None, None, None))
+            result.append(certificates.Certificate(
+                    row.start_no, row.name, format_duration(row.time), place,
+                    row.age_class, age_class_place))
+        return result
+
+
+class ReportJob(ndb.Model):
+    """Background generation of one report, child of its Event
+
+    The id is the report's cache key, so requesting the same report for
+    unchanged event data reuses the job and its file.
+    """
+
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    date = ndb.DateTimeProperty(auto_now_add=True)
+    report_type = ndb.StringProperty(indexed=False)
+    params = ndb.JsonProperty()
+    status = ndb.StringProperty(indexed=False, default=PENDING)
+    # Cloud Storage file name of the generated report
+    filename = ndb.StringProperty(indexed=False)
+    # Revision of the Results the chunks are generated from
+    revision = ndb.IntegerProperty(indexed=False)
+    # Number of chunks of reports generated in chunks and chunks done
+    num_chunks = ndb.IntegerProperty(indexed=False, default=0)
+    chunks_done = ndb.IntegerProperty(indexed=False, repeated=True)
+
+    def chunk_filename(self, chunk=None):
+        """Return Cloud Storage file name of the report or of one chunk"""
+        suffix = '' if chunk is None else '-{}'.format(chunk)
+        return '/{}/reports/{}{}.pdf'.format(
+                app_identity.get_default_gcs_bucket_name(), self.key.id(),
+                suffix)
+
+    def is_current(self, results):
+        """Return whether results are of the revision of the chunks"""
+        return self.revision == results.revision
+
+    @classmethod
+    def start_chunks(klass, key, ranges, revision):
+        """Enqueue generation of chunks with (first, last) start numbers
+
+        The ranges are taken from the Results of the given revision, the
+        chunks are only generated from Results of that revision.  A
+        transaction can only enqueue a few tasks, so the chunk tasks are
+        enqueued after storing the number of chunks.  They are named after
+        the job, so enqueueing them again on a retry has no effect.
+        """
+        job = klass._set_num_chunks(key, len(ranges), revision)
+        prefix = 'report-chunk-{}-{:%Y%m%d%H%M%S%f}'.format(key.urlsafe(),
+                                                             job.date)
+        for i, (first, last) in enumerate(ranges):
+            try:
+                taskqueue.add(name='{}-{}'.format(prefix, i),
+                              url='/tasks/report_chunk',
+                              params={'job': key.urlsafe(), 'chunk': i,
+                                      'first': first, 'last': last},
+                              queue_name='reports')
+            except (taskqueue.TaskAlreadyExistsError,
+                    taskqueue.TombstonedTaskError):
+                pass
+
+    @classmethod
+    @ndb.transactional
+    def _set_num_chunks(klass, key, num_chunks, revision):
+        job = key.get()
+        if job.num_chunks != num_chunks or job.revision != revision:
+            job.num_chunks = num_chunks
+            job.revision = revision
+            job.chunks_done = []
+            job.put()
+        return job
+
+    @classmethod
+    @ndb.transactional
+    def chunk_done(klass, key, chunk):
+        """Mark chunk done, return whether all chunks are done"""
+        job = key.get()
+        if chunk not in job.chunks_done:
+            job.chunks_done.append(chunk)
+            job.put()
+        return (job.status == klass.PENDING and
+                len(job.chunks_done) == job.num_chunks)
+
+    @classmethod
+    @ndb.transactional
+    def get_or_start(klass, event, job_id, report_type, params):
+        """Return job for the report, enqueue its generation if necessary"""
+        job = klass.get_by_id(job_id, parent=event.key)
+        if job and job.status != klass.FAILED:
+            return job
+        job = klass(id=job_id, parent=event.key, report_type=report_type,
+                    params=params)
+        job.put()
+        taskqueue.add(url='/tasks/report', params={'job': job.key.urlsafe()},
+                      queue_name='reports', transactional=True)
+        return job
+
+
+def report_key(event, report_type, params):
+    """Return cache key for the report of event with the given parameters"""
+    return REPORT_CACHE.make_key(event.key.urlsafe(), event.revision,
+                                 report_type, sorted(params.items()))
+
+
+class EventReportHandler(BaseHandler):
+    """Handler for generating a report"""
+
+    def get(self, event_key, report_type):
+        event_key = ndb.Key(urlsafe=event_key)
+        event = event_key.get()
+        params = dict(self.request.GET.items())
+        # Reports are cached by event revision and report parameters
+        etag = report_key(event, report_type, params)
+        self.response.headers['Cache-Control'] = 'private, no-cache'
+        self.response.etag = etag
+        self.response.last_modified = event.updated
+        if etag in self.request.if_none_match:
+            self.response.status = 304
+            return
+
+        pdf = REPORT_CACHE.get(etag)
+        if pdf is None:
+            try:
+                pdf = ReportGenerator(event, params).render(report_type)
+            except ResultsPending:
+                self._redirect_results_pending(event)
+                return
+            except ValueError:
+                self.abort(404)
+            REPORT_CACHE.set(etag, pdf)
         self.response.headers['Content-Type'] = 'application/pdf'
-        disp = 'attachment; filename={}'.format('volkslauf.pdf')
-        #self.response.headers['Content-Disposition'] = disp
-        self.response.out.write(buf.getvalue())
+        self.response.out.write(pdf)
+
+
+class EventReportJobHandler(BaseHandler):
+    """Handler for generating a report in the background
+
+    Starts the generation and renders a page that polls the job status
+    and downloads the report once it is done.
+    """
+
+    def get(self, event_key, report_type):
+        if report_type not in REPORT_TYPES:
+            self.abort(404)
+        event = ndb.Key(urlsafe=event_key).get()
+        params = dict(self.request.GET.items())
+        if not event.results_counted:
+            self._redirect_results_pending(event)
+            return
+        job = ReportJob.get_or_start(event,
+                                     report_key(event, report_type, params),
+                                     report_type, params)
+        self._render('event/report_job.html', {'event': event, 'job': job})
+
+
+class ReportJobStatusHandler(BaseHandler):
+    """Handler returning the status of a ReportJob as JSON"""
+
+    def get(self, job_key):
+        job = ndb.Key(urlsafe=job_key).get()
+        if not job:
+            self.abort(404)
+        self._write_json({'status': job.status})
+
+
+class ReportJobDownloadHandler(BaseHandler,
+                               blobstore_handlers.BlobstoreDownloadHandler):
+    """Handler for downloading the file generated by a ReportJob"""
+
+    def get(self, job_key):
+        job = ndb.Key(urlsafe=job_key).get()
+        if not job or job.status != ReportJob.DONE:
+            self.abort(404)
+        self.send_blob(blobstore.create_gs_key('/gs' + job.filename),
+                       content_type='application/pdf')
+
+
+class ReportTaskHandler(BaseHandler):
+    """Task handler generating the report of a ReportJob
+
+    Stores the report in the default Cloud Storage bucket.  Certificates
+    for more than certificates.CHUNK_SIZE runners are generated in chunks
+    by ReportChunkTaskHandler instead.
+    """
+
+    def post(self):
+        import certificates
+        import cloudstorage as gcs
+        job = ndb.Key(urlsafe=self.request.get('job')).get()
+        event = job.key.parent().get()
+        try:
+            generator = ReportGenerator(event, job.params)
+            if job.report_type == 'certificates':
+                certs = generator.get_certificates()
+                ranges = certificates.chunk_ranges(
+                        [cert.start_no for cert in certs])
+                if len(ranges) > 1:
+                    ReportJob.start_chunks(job.key, ranges,
+                                           generator.results.revision)
+                    return
+                pdf = certificates.render(certs, event.title)
+            else:
+                pdf = generator.render(job.report_type)
+        except Exception:
+            logging.exception('Generating report %s failed', job.key.id())
+            job.status = ReportJob.FAILED
+            job.put()
+            return
+        job.filename = job.chunk_filename()
+        with gcs.open(job.filename, 'w',
+                      content_type='application/pdf') as f:
+            f.write(pdf)
+        job.status = ReportJob.DONE
+        job.put()
+
+
+class ReportChunkTaskHandler(BaseHandler):
+    """Task handler generating one chunk of the certificates of a ReportJob
+
+    The chunks are generated in parallel tasks, the task finishing the
+    last chunk merges them into the report.
+    """
+
+    def post(self):
+        import certificates
+        import cloudstorage as gcs
+        job = ndb.Key(urlsafe=self.request.get('job')).get()
+        event = job.key.parent().get()
+        chunk = int(self.request.get('chunk'))
+        try:
+            generator = ReportGenerator(event, job.params)
+            # The chunks' start number ranges and places must all be of
+            # the revision the ranges were taken from
+            if not job.is_current(generator.results):
+                raise ValueError('Event changed since the job was started')
+            pdf = certificates.render(
+                    generator.get_certificates(int(self.request.get('first')),
+                                               int(self.request.get('last'))),
+                    event.title)
+            with gcs.open(job.chunk_filename(chunk), 'w',
+                          content_type='application/pdf') as f:
+                f.write(pdf)
+            if ReportJob.chunk_done(job.key, chunk):
+                self._merge(job)
+        except Exception:
+            logging.exception('Generating chunk %d of report %s failed',
+                              chunk, job.key.id())
+            job = job.key.get()
+            job.status = ReportJob.FAILED
+            job.put()
+
+    def _merge(self, job):
+        import certificates
+        import cloudstorage as gcs
+        filenames = [job.chunk_filename(i) for i in range(job.num_chunks)]
+        pdfs = []
+        for filename in filenames:
+            with gcs.open(filename) as f:
+                pdfs.append(f.read())
+        pdf = certificates.merge(pdfs)
+        job = job.key.get()
+        job.filename = job.chunk_filename()
+        with gcs.open(job.filename, 'w',
+                      content_type='application/pdf') as f:
+            f.write(pdf)
+        job.status = ReportJob.DONE
+        job.put()
+        for filename in filenames:
+            gcs.delete(filename)
 
 
 class EventExportHandler(BaseHandler):
@@ -661,54 +1698,85 @@ class EventExportHandler(BaseHandler):
     def get(self, event_key, file_type):
         event_key = ndb.Key(urlsafe=event_key)
         event = event_key.get()
+        try:
+            runners = event.get_results().get_snapshot().rows()
+        except ResultsPending:
+            self._redirect_results_pending(event)
+            return
 
         if file_type == 'xls':
-            self._export_xls(event)
+            self._export_xls(event, runners)
         else:
-            self._export_tsv(event)
+            self._export_tsv(event, runners)
+
+    def _export_xls(self, event, runners):
+        """Write XLS export of event with runners iterable to the response
 
-    def _export_xls(self, event):
+        The row data is flushed every XLS_FLUSH_ROWS rows, so xlwt keeps
+        only the encoded records instead of the Row and Cell objects of all
+        runners.  The workbook is saved straight into the response.
+        """
+        import xlwt
         wb = xlwt.Workbook()
         ws = wb.add_sheet(event.title)
         HEADER = ['Startnr.', 'Name', 'Team', 'Geburtsjahr', 'Geschlecht',
                   'Altersklasse', 'Strecke', 'Zeit']
+        row = ws.row(0)
         for i, h in enumerate(HEADER):
-            ws.write(0, i, h)
-        for j, runner in enumerate(event.all_runners()):
-            ws.write(j + 1, 0, runner.start_no)
-            ws.write(j + 1, 1, runner.name)
-            ws.write(j + 1, 2, runner.team)
-            ws.write(j + 1, 3, runner.birth_year)
-            ws.write(j + 1, 4, 'm' if runner.gender == 'male' else 'f')
-            ws.write(j + 1, 5, runner.age_class)
-            ws.write(j + 1, 6, runner.race)
-            ws.write(j + 1, 7, runner.time)
-
-        out = StringIO.StringIO()
-        wb.save(out)
+            row.write(i, h)
+        for j, runner in enumerate(runners, 1):
+            row = ws.row(j)
+            row.write(0, runner.start_no)
+            row.write(1, runner.name)
+            row.write(2, runner.team)
+            row.write(3, runner.birth_year)
+            row.write(4, 'm' if runner.gender == 'male' else 'f')
+            row.write(5, runner.age_class)
+            row.write(6, runner.race)
+            row.write(7, format_duration(runner.time))
+            if (j + 1) % XLS_FLUSH_ROWS == 0:
+                ws.flush_row_data()
+        ws.flush_row_data()
+
         self.response.headers['Content-Type'] = 'application/vnd.ms-excel'
         disp = 'attachment; filename={}.xls'.format(event.key.urlsafe())
         self.response.headers['Content-Disposition'] = disp
-        self.response.out.write(out.getvalue())
+        wb.save(self.response.out)
 
-    def _export_tsv(self, event):
-        self.response.headers['Content-Type'] = 'text/plain'
+    def _export_tsv(self, event, runners):
+        self.response.headers['Content-Type'] = 'text/plain; charset=utf-8'
         disp = 'attachment; filename={}.tsv'.format(event.key.urlsafe())
         self.response.headers['Content-Disposition'] = disp
-        tpl = """
+        self.response.app_iter = self._iter_tsv(event, runners)
+
+    def _iter_tsv(self, event, runners):
+        """Yield TSV export of event in UTF-8 encoded chunks
+
+        The runners are written in chunks of EXPORT_BATCH_SIZE, so only the
+        current chunk is kept in memory in encoded form.
+        """
+        tpl = u"""
         #title:\t{title}
         #year:\t{year}
         #next_start_no:\t{next_start_no}
+        #age_class_rules:\t{age_class_rules}
         #start_no\tname\tteam\tbirth_year\tgender\tage_class\trace\ttime
         """
         tpl = textwrap.dedent(tpl).lstrip()
-        self.response.out.write(tpl.format(
+        yield tpl.format(
             title = event.title,
             year = event.year,
             next_start_no = event.next_start_no,
-        ))
-        for runner in event.all_runners():
-            self.response.out.write(runner.to_tsv())
+            age_class_rules = event.age_class_rules,
+        ).encode('utf-8')
+        rows = []
+        for runner in runners:
+            rows.append(runner_to_tsv(runner))
+            if len(rows) == EXPORT_BATCH_SIZE:
+                yield u''.join(rows).encode('utf-8')
+                rows = []
+        if rows:
+            yield u''.join(rows).encode('utf-8')
 
 
 
@@ -758,22 +1826,23 @@ class RunnerCreateHandler(BaseHandler):
         event = event_key.get()
         if event.next_start_no == form_result['start_no']:
             event.next_start_no += 1
-            event.put()
 
-        runner = Runner(parent=event_key,
+        runner = Runner(key=Runner.key_for(event_key, form_result['start_no']),
                         event=event_key,
                         **form_result)
-        return runner.put()
+        runner._event = event
+        event.count_runner(runner)
+        return ndb.put_multi([event, runner])[1]
 
 
 class RunnerUpdateHandler(BaseHandler):
     """Handler for updating details of a runner"""
 
     def get(self, event_key, runner_key):
-        runner_key = ndb.Key(urlsafe=runner_key)
-        event_key = ndb.Key(urlsafe=event_key)
-        vals = {'runner': runner_key.get().to_dict(),
-                'event': event_key.get()}
+        event, runner = ndb.get_multi([ndb.Key(urlsafe=event_key),
+                                       ndb.Key(urlsafe=runner_key)])
+        vals = {'runner': runner.to_dict(), 'event': event}
+        vals['runner']['time'] = format_duration(runner.time)
         self._render('runner/update.html', vals)
 
     def post(self, event_key, runner_key):
@@ -796,22 +1865,29 @@ class RunnerUpdateHandler(BaseHandler):
 
         Validation must be done in a transaction against race conditions
         """
-        runner = runner_key.get()
+        event, runner = ndb.get_multi([event_key, runner_key])
         state = RunnerFormEncodeState(event_key, runner_key)
         form = RunnerForm()
+        event.count_runner(runner, -1)
         runner.populate(**form.to_python(dict(self.request.params),
                                          state))
-        if not self.request.params('time'):
+        if not self.request.get('time'):
             runner.time = None
-        return runner.put()
+        runner._event = event
+        event.count_runner(runner)
+        if runner.key != Runner.key_for(event_key, runner.start_no):
+            # Start number changed or runner not keyed by it yet
+            runner_key.delete()
+            runner = runner.rekeyed()
+        return ndb.put_multi([event, runner])[1]
 
 
 class RunnerViewHandler(BaseHandler):
     """Handler for viewing details of a runner"""
 
     def get(self, event_key, runner_key):
-        runner = ndb.Key(urlsafe=runner_key).get()
-        event = ndb.Key(urlsafe=event_key).get()
+        event, runner = ndb.get_multi([ndb.Key(urlsafe=event_key),
+                                       ndb.Key(urlsafe=runner_key)])
         self._render('runner/view.html', {'event': event, 'runner': runner})
 
 
@@ -819,17 +1895,26 @@ class RunnerDeleteHandler(BaseHandler):
     """Handler for deleting a runner"""
 
     def get(self, event_key, runner_key):
-        event = ndb.Key(urlsafe=event_key).get()
-        runner = ndb.Key(urlsafe=runner_key).get()
+        event, runner = ndb.get_multi([ndb.Key(urlsafe=event_key),
+                                       ndb.Key(urlsafe=runner_key)])
         vals = {'event': event, 'runner': runner}
         self._render('runner/delete.html', vals)
 
     def post(self, event_key, runner_key):
         if self.request.get('submit_yes'):
-            runner_key = ndb.Key(urlsafe=runner_key)
-            runner_key.delete()
+            self._delete_runner(ndb.Key(urlsafe=event_key),
+                                ndb.Key(urlsafe=runner_key))
         self.redirect('/event/view/{}'.format(event_key))
 
+    @ndb.transactional
+    def _delete_runner(self, event_key, runner_key):
+        """Delete runner and update the event's counters"""
+        event, runner = ndb.get_multi([event_key, runner_key])
+        if runner:
+            event.count_runner(runner, -1)
+            event.put()
+            runner_key.delete()
+
 
 class RunnerFinishedHandler(BaseHandler):
     """Handler for a runner finishing"""
@@ -850,15 +1935,14 @@ class RunnerFinishedHandler(BaseHandler):
                 self.redirect('/event/view/{}'.format(event_key.urlsafe()))
                 return
 
-            runners = Runner.query(Runner.start_no == vals['start_no'],
-                                   ancestor=event_key)
-            runner = runners.get()
+            runner, place = self._set_time(event_key, vals['start_no'],
+                                           vals['time'])
             if runner:
-                runner.time = self.request.get('time')
-                runner.put()
-                msg = 'Zeit fuerr Laeufer {} gesetzt.'.format(runner.name)
+                msg = ('Zeit fuerr Laeufer {} gesetzt: {}. Platz gesamt, '
+                       '{}. Platz {}.').format(runner.name, place[0],
+                                               place[2], runner.age_class)
                 self.session.add_flash(msg, key='info')
-        except formencode.Invalid, e:
+        except formencode.Invalid:
             pass
 
         if not msg:
@@ -867,6 +1951,341 @@ class RunnerFinishedHandler(BaseHandler):
 
         self.redirect('/event/view/{}'.format(event_key.urlsafe()))
 
+    @ndb.transactional
+    def _set_time(self, event_key, start_no, time):
+        """Set time of runner with start_no, return (runner, place)
+
+        The place is (overall, gender, age_class), see
+        ranking.Ranking.place().  Returns (None, None) if there is no
+        runner with start_no.
+        """
+        event = event_key.get()
+        runner = event.runners_by_start_no([start_no]).get(start_no)
+        if not runner:
+            return None, None
+        event.count_runner(runner, -1)
+        runner.time = time
+        runner._event = event
+        event.count_runner(runner)
+        ndb.put_multi([event, runner])
+        return runner, event.results().ranking().place(start_no)
+
+
+class DurationMigrationHandler(BaseHandler):
+    """Task handler converting durations stored as strings to milliseconds
+
+    Rewrites one batch of runners per call and enqueues itself again until
+    no runner with a string duration is left.
+    """
+
+    BATCH_SIZE = 200
+
+    def post(self):
+        qry = Runner.query(ndb.GenericProperty('time') >= '')
+        runners = qry.fetch(self.BATCH_SIZE)
+        event_keys = list(set(runner.key.parent() for runner in runners))
+        events = dict(zip(event_keys, ndb.get_multi(event_keys)))
+        for runner in runners:
+            runner._event = events[runner.key.parent()]
+        # Durations were converted on load, putting stores them as integers
+        ndb.put_multi(runners)
+        logging.info('Converted durations of %d runners', len(runners))
+        if len(runners) == self.BATCH_SIZE:
+            taskqueue.add(url='/admin/migrate/durations')
+
+
+class ResultsMigrationHandler(BaseHandler):
+    """Task handler counting the Results of the events counted before
+
+    Enqueues the recount by RecountTaskHandler for every event whose
+    Results do not hold the snapshot and places pages yet.
+    """
+
+    def post(self):
+        for event in Event.query(ancestor=organization_key()):
+            if not event.results_counted:
+                event.start_recount()
+
+
+class RecountTaskHandler(BaseHandler):
+    """Task handler recounting an event not counted yet
+
+    Enqueued by Event.start_recount() for events read before they have been
+    counted, the request reading the event does not write it.
+    """
+
+    def post(self):
+        event = ndb.Key(urlsafe=self.request.get('event')).get()
+        if event and not event.results_counted:
+            Event.recount(event.key)
+
+
+class AgeClassTaskHandler(BaseHandler):
+    """Task handler recomputing the age classes of an event's runners
+
+    Walks the runners with a keys-only cursor, one batch per task, and
+    writes only the runners whose age class changed.
+    """
+
+    BATCH_SIZE = 200
+
+    def post(self):
+        event_key = ndb.Key(urlsafe=self.request.get('event'))
+        generation = int(self.request.get('generation'))
+        cursor = self.request.get('cursor')
+        cursor = Cursor(urlsafe=cursor) if cursor else None
+        keys, next_cursor, more = Event.query_runners(event_key).fetch_page(
+                self.BATCH_SIZE, start_cursor=cursor, keys_only=True)
+        self._update_batch(event_key, generation, keys,
+                           next_cursor if more else None)
+
+    @ndb.transactional
+    def _update_batch(self, event_key, generation, keys, next_cursor):
+        """Update age classes of the runners with keys
+
+        Enqueues the task for the next batch if next_cursor is given.
+        """
+        event, job = ndb.get_multi([event_key,
+                                    AgeClassJob.key_for(event_key)])
+        if not event or not job or job.generation != generation:
+            return  # restarted or event deleted
+        table = event.age_class_table()
+        changed = []
+        for runner in ndb.get_multi(keys):
+            age_class = table.classify(event.year, runner.gender,
+                                       runner.birth_year)
+            if age_class and age_class != runner.age_class:
+                event.count_runner(runner, -1)
+                runner.age_class = age_class
+                event.count_runner(runner)
+                runner._event = event
+                changed.append(runner)
+        job.num_processed += len(keys)
+        job.num_changed += len(changed)
+        job.done = not next_cursor
+        to_put = [job] + changed
+        if changed:
+            to_put.append(event)
+        ndb.put_multi(to_put)
+        if next_cursor:
+            taskqueue.add(url='/tasks/age_classes',
+                          params={'event': event_key.urlsafe(),
+                                  'generation': generation,
+                                  'cursor': next_cursor.urlsafe()},
+                          transactional=True)
+
+
+class RunnerFinishedBatchHandler(BaseHandler):
+    """JSON API for entering batches of finish times
+
+    Expects a JSON object such as
+
+        {"batch_id": "station1-0042",
+         "records": [{"start_no": 12, "time": "52:13"}, ...]}
+
+    and returns {"results": [...]} with one result per record, either
+    {"start_no": ..., "status": "ok", "name": ..., "time": ...,
+    "place": [overall, gender, age_class], "age_class": ...} or
+    {"start_no": ..., "status": "error", "message": ...}.  The optional
+    batch_id makes retrying a batch safe.
+
+    In timing mode, records carry "recorded_ago" instead of "time", see
+    RunnerArrivalForm, and the time is computed from the race's start.
+
+    Records for runners that already have a different time are not applied
+    but reported with status "conflict" and the existing time, unless the
+    record has "force": true.
+    """
+
+    # Limited by the number of entities written in one transaction
+    MAX_RECORDS = 400
+
+    def post(self, event_key):
+        received = datetime.datetime.utcnow()
+        event_key = ndb.Key(urlsafe=event_key)
+        try:
+            data = json.loads(self.request.body)
+            records = list(data['records'])
+            batch_id = data.get('batch_id')
+            if batch_id is not None:
+                batch_id = unicode(batch_id)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.abort(400)
+        if len(records) > self.MAX_RECORDS:
+            self.abort(413)
+        self._write_json({'results': self._apply(event_key, batch_id,
+                                                 records, received)})
+
+    def _validate(self, record, received):
+        """Return (start_no, time, arrival, force) of record
+
+        Either time or the arrival time is None.  Raises formencode.Invalid
+        for invalid records.
+        """
+        if not isinstance(record, dict):
+            raise formencode.Invalid('Ungueltiger Eintrag', record, None)
+        force = record.get('force') is True
+        record = dict((k, unicode(v)) for k, v in record.items())
+        if 'time' not in record:
+            vals = RunnerArrivalForm().to_python(record)
+            arrival = received - datetime.timedelta(
+                    milliseconds=vals['recorded_ago'])
+            return vals['start_no'], None, arrival, force
+        vals = RunnerFinishedForm().to_python(record)
+        if not vals['time']:
+            raise formencode.Invalid('Keine Zeit angegeben', record, None)
+        return vals['start_no'], vals['time'], None, force
+
+    def _time_since_start(self, event, runner, arrival):
+        """Return milliseconds from the start of runner's race to arrival
+
+        Returns None if the race has not started or started after arrival.
+        """
+        start_time = event.get_race_stats(runner.race).start_time
+        if not start_time or start_time > arrival:
+            return None
+        delta = arrival - start_time
+        return ((delta.days * 24 * 60 * 60 + delta.seconds) * 1000 +
+                delta.microseconds // 1000)
+
+    @ndb.transactional
+    def _apply(self, event_key, batch_id, records, received):
+        if batch_id:
+            batch = FinishBatch.get_by_id(batch_id, parent=event_key)
+            if batch:
+                return batch.results
+
+        results = []
+        valid = []
+        for record in records:
+            try:
+                valid.append(self._validate(record, received))
+                results.append(None)
+            except formencode.Invalid, e:
+                start_no = record.get('start_no') if isinstance(
+                        record, dict) else None
+                results.append({'start_no': start_no, 'status': 'error',
+                                'message': unicode(e)})
+
+        event = event_key.get()
+        runners = event.runners_by_start_no([v[0] for v in valid])
+        changed = {}
+        valid = iter(valid)
+        for i, result in enumerate(results):
+            if result:
+                continue
+            start_no, time, arrival, force = next(valid)
+            runner = runners.get(start_no)
+            if not runner:
+                results[i] = {'start_no': start_no, 'status': 'error',
+                              'message': 'Unbekannte Startnr.'}
+                continue
+            if arrival:
+                time = self._time_since_start(event, runner, arrival)
+                if time is None:
+                    results[i] = {'start_no': start_no, 'status': 'error',
+                                  'message': 'Kein Start fuer {}'.format(
+                                      runner.race)}
+                    continue
+            else:
+                time = parse_duration(time)
+            if runner.time is not None and runner.time != time and not force:
+                results[i] = {'start_no': start_no, 'status': 'conflict',
+                              'name': runner.name,
+                              'message': 'Zeit bereits erfasst',
+                              'existing': format_duration(runner.time)}
+                continue
+            event.count_runner(runner, -1)
+            runner.time = time
+            runner._event = event
+            event.count_runner(runner)
+            changed[runner.key] = runner
+            results[i] = {'start_no': start_no, 'status': 'ok',
+                          'name': runner.name,
+                          'time': format_duration(runner.time)}
+
+        if changed:
+            ranking_ = event.results().ranking()
+            for result in results:
+                if result['status'] == 'ok':
+                    runner = runners[result['start_no']]
+                    result['place'] = ranking_.place(runner.start_no)
+                    result['age_class'] = (runner._compute_age_class() or
+                                           runner.age_class)
+        to_put = changed.values()
+        if changed:
+            to_put.append(event)
+        if batch_id:
+            to_put.append(FinishBatch(id=batch_id, parent=event_key,
+                                      results=results))
+        ndb.put_multi(to_put)
+        return results
+
+
+class RunnerKeyMigrationHandler(BaseHandler):
+    """Task handler re-keying the runners of events by start number
+
+    Without event parameter, enqueues one task per event not migrated yet.
+    With event parameter, migrates one batch of runners per call and
+    enqueues itself for the next batch.  Runners sharing a start number
+    with another runner are left alone and keep the event unmigrated.
+    """
+
+    BATCH_SIZE = 100
+
+    def post(self):
+        if not self.request.get('event'):
+            for event in Event.query(ancestor=organization_key()):
+                if not event.runners_keyed:
+                    taskqueue.add(url='/admin/migrate/runner_keys',
+                                  params={'event': event.key.urlsafe()})
+            return
+
+        event_key = ndb.Key(urlsafe=self.request.get('event'))
+        cursor = self.request.get('cursor')
+        cursor = Cursor(urlsafe=cursor) if cursor else None
+        qry = Runner.query(ancestor=event_key)
+        keys, next_cursor, more = qry.fetch_page(
+                self.BATCH_SIZE, start_cursor=cursor, keys_only=True)
+        # Integer ids sort before the start number names
+        legacy = [k for k in keys if k.integer_id()]
+        if legacy:
+            self._migrate_batch(event_key, legacy)
+        if more and len(legacy) == len(keys):
+            taskqueue.add(url='/admin/migrate/runner_keys',
+                          params={'event': event_key.urlsafe(),
+                                  'cursor': next_cursor.urlsafe()})
+        else:
+            self._finish(event_key)
+
+    @ndb.transactional
+    def _migrate_batch(self, event_key, keys):
+        event = event_key.get()
+        runners = [r for r in ndb.get_multi(keys) if r]
+        new_keys = [Runner.key_for(event_key, r.start_no) for r in runners]
+        seen = set(k for k, r in zip(new_keys, ndb.get_multi(new_keys)) if r)
+        to_put = []
+        to_delete = []
+        for runner, new_key in zip(runners, new_keys):
+            if new_key in seen:
+                logging.warning('Duplicate start no %d in event %s',
+                                runner.start_no, event_key.urlsafe())
+                continue
+            seen.add(new_key)
+            runner._event = event
+            to_put.append(runner.rekeyed())
+            to_delete.append(runner.key)
+        ndb.delete_multi(to_delete)
+        ndb.put_multi(to_put + [event])
+
+    @ndb.transactional
+    def _finish(self, event_key):
+        """Mark event as migrated if no runner with integer id is left"""
+        event = event_key.get()
+        first = Runner.query(ancestor=event_key).get(keys_only=True)
+        event.runners_keyed = not (first and first.integer_id())
+        event.put()
+
 
 ROUTE_LIST = [
     ('/', EventListHandler),
@@ -874,15 +2293,31 @@ ROUTE_LIST = [
     ('/event/import', EventImportHandler),
     ('/event/create', EventCreateHandler),
     ('/event/view/<event_key>', EventViewHandler),
+    ('/event/<event_key>/runners', EventRunnersHandler),
+    ('/event/<event_key>/start/<race>', EventStartHandler),
+    ('/event/<event_key>/roster', EventRosterHandler),
+    ('/event/<event_key>/finish_line', EventFinishLineHandler),
     ('/event/update/<event_key>', EventUpdateHandler),
     ('/event/delete/<event_key>', EventDeleteHandler),
+    ('/event/<event_key>/recount', EventRecountHandler),
     ('/event/<event_key>/report/<report_type>', EventReportHandler),
+    ('/event/<event_key>/report_job/<report_type>', EventReportJobHandler),
+    ('/report_job/<job_key>/status', ReportJobStatusHandler),
+    ('/report_job/<job_key>/download', ReportJobDownloadHandler),
     ('/event/<event_key>/export/<file_type>', EventExportHandler),
     ('/runner/<event_key>/create', RunnerCreateHandler),
     ('/runner/<event_key>/update/<runner_key>', RunnerUpdateHandler),
     ('/runner/<event_key>/view/<runner_key>', RunnerViewHandler),
     ('/runner/<event_key>/delete/<runner_key>', RunnerDeleteHandler),
     ('/runner/<event_key>/finished', RunnerFinishedHandler),
+    ('/runner/<event_key>/finished_batch', RunnerFinishedBatchHandler),
+    ('/admin/migrate/durations', DurationMigrationHandler),
+    ('/admin/migrate/runner_keys', RunnerKeyMigrationHandler),
+    ('/admin/migrate/results', ResultsMigrationHandler),
+    ('/tasks/report', ReportTaskHandler),
+    ('/tasks/report_chunk', ReportChunkTaskHandler),
+    ('/tasks/age_classes', AgeClassTaskHandler),
+    ('/tasks/recount', RecountTaskHandler),
 ]
 ROUTES = [webapp2.Route(*list(x)) for x in ROUTE_LIST]
 
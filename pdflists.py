@@ -0,0 +1,139 @@
+"""Runner lists rendered directly as PDF with ReportLab platypus
+
+Lays out the starter and finished lists as platypus tables with the page
+layout of _report.html, without generating and parsing HTML.  Texts of
+left aligned columns such as names and teams wrap within their column.
+Headers of tables split across pages are repeated.
+"""
+
+from __future__ import division, print_function
+
+import StringIO
+import collections
+from xml.sax.saxutils import escape
+
+from reportlab.lib import colors
+from reportlab.lib import pagesizes
+from reportlab.lib import units
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.pdfgen import canvas
+from reportlab.platypus import Paragraph
+from reportlab.platypus import SimpleDocTemplate
+from reportlab.platypus import Spacer
+from reportlab.platypus import Table
+from reportlab.platypus import TableStyle
+
+
+# Column of a list, width as fraction of the page width and alignment
+# LEFT, CENTER or RIGHT
+Column = collections.namedtuple('Column', ['title', 'width', 'align'])
+
+# Table of a list with headings given as (level, text), level 2 or 3
+Section = collections.namedtuple('Section', ['headings', 'rows'])
+
+# Columns of the starter list
+STARTER_COLUMNS = [Column('Startnr.', 0.1, 'RIGHT'),
+                   Column('Name', 0.3, 'LEFT'),
+                   Column('Verein', 0.3, 'LEFT'),
+                   Column('m/w', 0.1, 'CENTER'),
+                   Column('Klasse', 0.1, 'LEFT'),
+                   Column('Strecke', 0.1, 'RIGHT')]
+
+# Columns of the finished lists
+FINISHED_COLUMNS = [Column('Platz', 0.1, 'RIGHT'),
+                    Column('Name', 0.3, 'LEFT'),
+                    Column('Team', 0.3, 'LEFT'),
+                    Column('Altersklasse', 0.15, 'LEFT'),
+                    Column('Zeit', 0.15, 'RIGHT')]
+
+FONT = 'Helvetica'
+BOLD_FONT = 'Helvetica-Bold'
+FONT_SIZE = 11
+LEADING = 14
+
+PAGE_SIZE = pagesizes.A4
+MARGINS = {'topMargin': 3 * units.cm, 'rightMargin': 2 * units.cm,
+           'bottomMargin': 3 * units.cm, 'leftMargin': 2 * units.cm}
+
+HEADING_STYLES = {
+    2: ParagraphStyle('h2', fontName=BOLD_FONT, fontSize=16, leading=20,
+                      spaceBefore=10, spaceAfter=4, keepWithNext=True),
+    3: ParagraphStyle('h3', fontName=BOLD_FONT, fontSize=13, leading=16,
+                      spaceBefore=8, spaceAfter=4, keepWithNext=True),
+}
+
+TITLE_STYLE = ParagraphStyle('h1', fontName=BOLD_FONT, fontSize=22,
+                             leading=26, alignment=TA_CENTER)
+
+# Style of the wrapped texts of left aligned columns
+CELL_STYLE = ParagraphStyle('cell', fontName=FONT, fontSize=FONT_SIZE,
+                            leading=LEADING)
+
+
+class _NumberedCanvas(canvas.Canvas):
+    """Canvas keeping the pages until saved to write 'Seite x / y'"""
+
+    def __init__(self, *args, **kwargs):
+        canvas.Canvas.__init__(self, *args, **kwargs)
+        self._pages = []
+
+    def showPage(self):
+        self._pages.append(dict(self.__dict__))
+        self._startPage()
+
+    def save(self):
+        num_pages = len(self._pages)
+        for page in self._pages:
+            self.__dict__.update(page)
+            self.setFont(FONT, FONT_SIZE)
+            self.drawCentredString(
+                    PAGE_SIZE[0] / 2, 1.3 * units.cm,
+                    'Seite {} / {}'.format(self._pageNumber, num_pages))
+            canvas.Canvas.showPage(self)
+        canvas.Canvas.save(self)
+
+
+def _table(columns, rows, width):
+    style = [
+        ('FONT', (0, 0), (-1, -1), FONT, FONT_SIZE),
+        ('FONT', (0, 0), (-1, 0), BOLD_FONT, FONT_SIZE),
+        ('LINEBELOW', (0, 0), (-1, 0), 0.5, colors.black),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ]
+    for i, column in enumerate(columns):
+        if column.align != 'LEFT':
+            style.append(('ALIGN', (i, 1), (i, -1), column.align))
+    data = [[column.title for column in columns]]
+    data.extend([_cell(column, value) for column, value in zip(columns, row)]
+                for row in rows)
+    return Table(data, colWidths=[c.width * width for c in columns],
+                 repeatRows=1, hAlign='LEFT', style=TableStyle(style))
+
+
+def _cell(column, value):
+    text = u'' if value is None else unicode(value)
+    if column.align == 'LEFT' and text:
+        return Paragraph(escape(text), CELL_STYLE)
+    return text
+
+
+def render(title, columns, sections):
+    """Return PDF with the title on each page and a table per Section"""
+    buf = StringIO.StringIO()
+    doc = SimpleDocTemplate(buf, pagesize=PAGE_SIZE, title=title,
+                            **MARGINS)
+    title = Paragraph(escape(title), TITLE_STYLE)
+
+    def draw_header(c, doc):
+        _, height = title.wrap(doc.width, MARGINS['topMargin'])
+        title.drawOn(c, doc.leftMargin, PAGE_SIZE[1] - 2 * units.cm - height)
+
+    story = [Spacer(0, 0)]
+    for section in sections:
+        for level, text in section.headings:
+            story.append(Paragraph(escape(text), HEADING_STYLES[level]))
+        story.append(_table(columns, section.rows, doc.width))
+    doc.build(story, onFirstPage=draw_header, onLaterPages=draw_header,
+              canvasmaker=_NumberedCanvas)
+    return buf.getvalue()
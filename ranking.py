@@ -0,0 +1,172 @@
+"""Placings of the finished runners
+
+The Ranking keeps the finished runners of each race sorted by time and is
+updated entry by entry as finish times arrive.  The places overall, by
+gender and by age class are computed in one pass over each race.  Runners
+with the same time share their place and the following place is skipped,
+e.g. 1, 2, 2, 4.
+
+For looking up the place of a single runner, the Ranking also keeps the
+times of each race, gender and age class in SortedBlocks.  Rankings are
+kept in memory between requests by RankingCache.
+"""
+
+from __future__ import division, print_function
+
+import bisect
+import collections
+import threading
+
+
+class SortedBlocks(object):
+    """Sorted multiset of values stored in blocks of limited size
+
+    Inserting and removing a value bisect the block maxima and then one
+    block, so at most one block's values are moved.  rank() additionally
+    sums up the sizes of the preceding blocks.
+    """
+
+    BLOCK_SIZE = 256
+
+    def __init__(self):
+        self.blocks = []
+        # Largest value of each block
+        self.maxes = []
+
+    def __len__(self):
+        return sum(len(block) for block in self.blocks)
+
+    def insert(self, value):
+        if not self.blocks:
+            self.blocks.append([value])
+            self.maxes.append(value)
+            return
+        i = min(bisect.bisect_left(self.maxes, value), len(self.blocks) - 1)
+        block = self.blocks[i]
+        bisect.insort(block, value)
+        self.maxes[i] = block[-1]
+        if len(block) > 2 * self.BLOCK_SIZE:
+            self.blocks[i:i + 1] = [block[:self.BLOCK_SIZE],
+                                    block[self.BLOCK_SIZE:]]
+            self.maxes[i:i + 1] = [block[self.BLOCK_SIZE - 1], block[-1]]
+
+    def remove(self, value):
+        """Remove one occurrence of value, which must be present"""
+        i = bisect.bisect_left(self.maxes, value)
+        block = self.blocks[i]
+        del block[bisect.bisect_left(block, value)]
+        if block:
+            self.maxes[i] = block[-1]
+        else:
+            del self.blocks[i]
+            del self.maxes[i]
+
+    def rank(self, value):
+        """Return number of values less than value"""
+        i = bisect.bisect_left(self.maxes, value)
+        result = sum(len(block) for block in self.blocks[:i])
+        if i < len(self.blocks):
+            result += bisect.bisect_left(self.blocks[i], value)
+        return result
+
+
+class Ranking(object):
+    """Finished runners sorted by time per race"""
+
+    def __init__(self, entries=None):
+        # Sorted lists of (time, start_no, gender, age_class) by race
+        self.races = {}
+        # Race and entry of each start number
+        self.by_start_no = {}
+        # SortedBlocks of the times by group, see _groups()
+        self.groups = {}
+        for race, time, start_no, gender, age_class in entries or []:
+            self.add(start_no, race, time, gender, age_class)
+
+    def add(self, start_no, race, time, gender, age_class):
+        """Add or replace the entry of the runner with start_no"""
+        self.remove(start_no)
+        entry = (time, start_no, gender, age_class)
+        bisect.insort(self.races.setdefault(race, []), entry)
+        self.by_start_no[start_no] = (race, entry)
+        for group in self._groups(race, entry):
+            self.groups.setdefault(group, SortedBlocks()).insert(time)
+
+    def remove(self, start_no):
+        """Remove the entry of the runner with start_no if any"""
+        if start_no not in self.by_start_no:
+            return
+        race, entry = self.by_start_no.pop(start_no)
+        entries = self.races[race]
+        del entries[bisect.bisect_left(entries, entry)]
+        for group in self._groups(race, entry):
+            self.groups[group].remove(entry[0])
+
+    @staticmethod
+    def _groups(race, entry):
+        _, _, gender, age_class = entry
+        return (race,), (race, gender), (race, gender, age_class)
+
+    def place(self, start_no):
+        """Return (overall, gender, age_class) place of runner with start_no
+
+        Returns None if the runner has not finished.
+        """
+        if start_no not in self.by_start_no:
+            return None
+        race, entry = self.by_start_no[start_no]
+        return tuple(self.groups[group].rank(entry[0]) + 1
+                     for group in self._groups(race, entry))
+
+    def entries(self):
+        """Return list of (race, time, start_no, gender, age_class)"""
+        return [(race,) + entry for race, entries in sorted(self.races.items())
+                for entry in entries]
+
+    def places(self):
+        """Return dict with (overall, gender, age_class) place by start_no"""
+        result = {}
+        for entries in self.races.values():
+            # Last (time, place) and number of runners by group
+            last = {}
+            counts = {}
+            for entry in entries:
+                time, start_no, gender, age_class = entry
+                places = []
+                for group in ((), (gender,), (gender, age_class)):
+                    counts[group] = counts.get(group, 0) + 1
+                    last_time, last_place = last.get(group, (None, None))
+                    place = last_place if last_time == time else counts[group]
+                    last[group] = (time, place)
+                    places.append(place)
+                result[start_no] = tuple(places)
+        return result
+
+
+class RankingCache(object):
+    """Thread-safe cache of Rankings by key and revision
+
+    A Ranking is taken out of the cache for updating it and put back with
+    its new revision once the update has been committed, so an aborted
+    update never leaves a modified Ranking behind.
+    """
+
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, revision):
+        """Remove and return Ranking for key if at revision, else None"""
+        with self._lock:
+            item = self._items.pop(key, None)
+        if item and item[0] == revision:
+            return item[1]
+        return None
+
+    def put(self, key, revision, ranking):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (revision, ranking)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
@@ -0,0 +1,75 @@
+"""Cache for generated reports
+
+The cache keys include the revision of the event data, so every write to
+an event or its runners makes the previously cached reports unreachable
+without explicit invalidation.  Stale entries age out of the caches.
+"""
+
+from __future__ import division, print_function
+
+import collections
+import hashlib
+import threading
+
+from google.appengine.api import memcache
+
+
+class LRUCache(object):
+    """Thread-safe LRU cache bounded by the total length of its values"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.pop(key, None)
+            if value is not None:
+                self._items[key] = value
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_size:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._items[key] = value
+            self.size += len(value)
+            while self.size > self.max_size:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class ReportCache(object):
+    """Instance-local LRU cache in front of memcache"""
+
+    # memcache does not store values larger than 1 MB
+    MAX_MEMCACHE_SIZE = 1000 * 1000
+
+    def __init__(self, max_local_size, namespace='reports', time=24 * 60 * 60):
+        self.local = LRUCache(max_local_size)
+        self.namespace = namespace
+        self.time = time
+
+    @staticmethod
+    def make_key(*parts):
+        """Return key for the given parts, also suitable as ETag"""
+        return hashlib.sha1(repr(parts)).hexdigest()
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None:
+            value = memcache.get(key, namespace=self.namespace)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        if len(value) <= self.MAX_MEMCACHE_SIZE:
+            memcache.set(key, value, time=self.time,
+                         namespace=self.namespace)
@@ -0,0 +1,177 @@
+"""Packed snapshot of an event's runners
+
+Keeps the runner data used by the reports and exports in array columns,
+so reading an event is one entity get and a few array decodes instead of
+instantiating one model per runner.  Strings such as names, teams and
+races are stored as indexes into a string table, missing values as -1.
+"""
+
+from __future__ import division, print_function
+
+import array
+import collections
+import json
+import struct
+import sys
+
+
+# One runner of the snapshot, attributes named as in the Runner model
+Row = collections.namedtuple('Row', ['start_no', 'name', 'team', 'gender',
+                                     'birth_year', 'age_class', 'race',
+                                     'time'])
+
+# Columns holding indexes into the string table
+STRING_COLUMNS = ('name', 'team', 'gender', 'age_class', 'race')
+
+# Type code of all column arrays, 4 byte signed integers
+TYPECODE = 'i'
+
+# Header of the packed format: version and length of the JSON part
+HEADER = struct.Struct('<BI')
+VERSION = 1
+
+
+class Snapshot(object):
+    """Runners of an event in array columns
+
+    Rows are not kept in any particular order, removing a row moves the
+    last row into its place.  The rows can be iterated sorted by start
+    number or finished rows by time.
+    """
+
+    def __init__(self):
+        self.columns = collections.OrderedDict(
+                (name, array.array(TYPECODE)) for name in Row._fields)
+        self.strings = []
+        self._string_ids = {}
+        self._rows = {}
+
+    def __len__(self):
+        return len(self.columns['start_no'])
+
+    def __contains__(self, start_no):
+        return start_no in self._rows
+
+    def add(self, row):
+        """Add or replace the row with row.start_no"""
+        self.remove(row.start_no)
+        self._rows[row.start_no] = len(self)
+        for name, value in zip(Row._fields, row):
+            if name in STRING_COLUMNS:
+                value = self._string_id(value)
+            elif value is None:
+                value = -1
+            self.columns[name].append(value)
+
+    def remove(self, start_no):
+        """Remove the row with start_no if any"""
+        i = self._rows.pop(start_no, None)
+        if i is None:
+            return
+        last = len(self) - 1
+        for column in self.columns.values():
+            column[i] = column[last]
+            column.pop()
+        if i != last:
+            self._rows[self.columns['start_no'][i]] = i
+
+    def _string_id(self, value):
+        if value is None:
+            return -1
+        result = self._string_ids.get(value)
+        if result is None:
+            result = self._string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return result
+
+    def _row(self, i):
+        strings = self.strings
+        values = []
+        for name, column in self.columns.items():
+            value = column[i]
+            if value == -1:
+                value = None
+            elif name in STRING_COLUMNS:
+                value = strings[value]
+            values.append(value)
+        return Row(*values)
+
+    def rows(self, race=None):
+        """Yield the Rows ordered by start number
+
+        The Rows are created while iterating, so exports only keep the
+        current one in memory.
+        """
+        for _, i in sorted(self._rows.items()):
+            if not race or self._row_race(i) == race:
+                yield self._row(i)
+
+    def finished_rows(self, race=None, time_from=None, time_to=None):
+        """Return list of the finished Rows ordered by time
+
+        Optionally restricted to one race and to times in milliseconds
+        within [time_from, time_to].
+        """
+        times = self.columns['time']
+        time_from = time_from or 0
+        indexes = [i for i in xrange(len(self))
+                   if times[i] >= time_from and
+                   (time_to is None or times[i] <= time_to) and
+                   (not race or self._row_race(i) == race)]
+        indexes.sort(key=lambda i: (times[i], self.columns['start_no'][i]))
+        return [self._row(i) for i in indexes]
+
+    def _row_race(self, i):
+        race = self.columns['race'][i]
+        return self.strings[race] if race != -1 else None
+
+    def compact(self):
+        """Drop the strings no longer referenced by any row"""
+        used = sorted(set(i for name in STRING_COLUMNS
+                          for i in self.columns[name] if i != -1))
+        mapping = dict((old, new) for new, old in enumerate(used))
+        mapping[-1] = -1
+        for name in STRING_COLUMNS:
+            self.columns[name] = array.array(
+                    TYPECODE, (mapping[i] for i in self.columns[name]))
+        self.strings = [self.strings[i] for i in used]
+        self._string_ids = dict((s, i) for i, s in enumerate(self.strings))
+
+    def pack(self):
+        """Return the compacted snapshot as byte string"""
+        self.compact()
+        header = json.dumps({'strings': self.strings, 'size': len(self)},
+                            separators=(',', ':'))
+        parts = [HEADER.pack(VERSION, len(header)), header]
+        for column in self.columns.values():
+            if sys.byteorder != 'little':
+                column = array.array(TYPECODE, column)
+                column.byteswap()
+            parts.append(column.tostring())
+        return ''.join(parts)
+
+    @classmethod
+    def unpack(klass, data):
+        """Return Snapshot from byte string returned by pack()"""
+        version, header_size = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise ValueError('Unknown snapshot version {}'.format(version))
+        pos = HEADER.size
+        header = json.loads(data[pos:pos + header_size])
+        pos += header_size
+        result = klass()
+        size = header['size'] * array.array(TYPECODE).itemsize
+        for name in Row._fields:
+            column = array.array(TYPECODE)
+            column.fromstring(data[pos:pos + size])
+            if sys.byteorder != 'little':
+                column.byteswap()
+            result.columns[name] = column
+            pos += size
+        result.strings = header['strings']
+        result._string_ids = dict(
+                (s, i) for i, s in enumerate(result.strings))
+        result._rows = dict(
+                (start_no, i)
+                for i, start_no in enumerate(result.columns['start_no']))
+        return result